@@ -0,0 +1,152 @@
+from __future__ import division
+import numpy as np
+
+class ActivationEngine(object):
+    """
+    Keeps the encounter times and decays of all facts in contiguous arrays, so that the activation of every fact can be calculated in a single vectorised pass.
+    Each fact occupies one row; rows are padded up to the largest number of encounters of any fact.
+    """
+
+    def __init__(self, capacity = 8):
+        self.rows = {}
+        self.times = np.zeros((0, capacity))
+        self.decays = np.zeros((0, capacity))
+        self.all_counts = np.zeros(0, dtype = np.int64)
+        self.all_last_times = np.zeros(0)
+        self.n_rows = 0
+        self.max_count = 0
+
+
+    def __len__(self):
+        return(self.n_rows)
+
+
+    @property
+    def counts(self):
+        return(self.all_counts[:self.n_rows])
+
+
+    @property
+    def last_times(self):
+        return(self.all_last_times[:self.n_rows])
+
+
+    def add_row(self, fact_id):
+        # type: (int) -> int
+        """
+        Add an empty row for a fact and return its index.
+        """
+        row = self.n_rows
+        if row == self.times.shape[0]:
+            self._resize(max(2 * row, 16), self.times.shape[1])
+
+        self.all_counts[row] = 0
+        self.all_last_times[row] = -np.inf
+        self.n_rows += 1
+        self.rows[fact_id] = row
+        return(row)
+
+
+    def set_encounters(self, fact_id, times, decays):
+        # type: (int, [int], [float]) -> None
+        """
+        Replace the encounter times and decays stored for a fact.
+        """
+        row = self.rows[fact_id]
+        n = len(times)
+        if n > self.times.shape[1]:
+            self._resize(self.times.shape[0], max(2 * self.times.shape[1], n))
+
+        self.times[row, :n] = times
+        self.decays[row, :n] = decays
+        self.all_counts[row] = n
+        self.all_last_times[row] = max(times) if n > 0 else -np.inf
+        self.max_count = max(self.max_count, n)
+
+
+    def calculate_activations(self, time, rows = None):
+        # type: (int, [int]) -> np.ndarray
+        """
+        Calculate the activation of every fact at the given time, in row order.
+        If rows are specified, only the activations of those facts are calculated and returned in the same order.
+        Facts without any encounter before this time have an activation of -inf.
+        """
+        if rows is not None:
+            return(self._calculate_row_activations(time, np.asarray(rows, dtype = np.int64)))
+
+        activations = np.full(self.n_rows, -np.inf)
+        seen_rows = np.flatnonzero(self.counts > 0)
+        if len(seen_rows) > 0:
+            activations[seen_rows] = self._calculate_row_activations(time, seen_rows)
+
+        return(activations)
+
+
+    def stale_rows(self, time):
+        # type: (int) -> np.ndarray
+        """
+        Return the rows of facts that have an encounter at or after the given time.
+        Their stored decays reflect responses that had not happened yet at that time, so their activation must be recalculated from their history.
+        """
+        return(np.flatnonzero((self.counts > 0) & (self.last_times >= time)))
+
+
+    def _calculate_row_activations(self, time, rows):
+        # type: (int, np.ndarray) -> np.ndarray
+        times = self.times[rows, :self.max_count]
+        decays = self.decays[rows, :self.max_count]
+        included = (np.arange(self.max_count) < self.all_counts[rows, np.newaxis]) & (times < time)
+
+        # ln(sum(t^-d)) = logsumexp(-d * ln(t)), with excluded encounters contributing exp(-inf) = 0
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            log_elapsed = np.log(np.where(included, (time - times) / 1000, 1.0))
+        terms = np.where(included, -decays * log_elapsed, -np.inf)
+        max_terms = terms.max(axis = 1) if self.max_count > 0 else np.full(len(rows), -np.inf)
+        shift = np.where(max_terms > -np.inf, max_terms, 0.0)
+
+        with np.errstate(divide = "ignore"):
+            return(np.log(np.exp(terms - shift[:, np.newaxis]).sum(axis = 1)) + shift)
+
+
+    def _resize(self, n_rows, n_cols):
+        # type: (int, int) -> None
+        times = np.zeros((n_rows, n_cols))
+        decays = np.zeros((n_rows, n_cols))
+        old_rows, old_cols = self.times.shape
+        times[:old_rows, :old_cols] = self.times
+        decays[:old_rows, :old_cols] = self.decays
+        self.times = times
+        self.decays = decays
+
+        if n_rows > old_rows:
+            self.all_counts = np.concatenate([self.all_counts, np.zeros(n_rows - old_rows, dtype = np.int64)])
+            self.all_last_times = np.concatenate([self.all_last_times, np.full(n_rows - old_rows, -np.inf)])
+
+
+def calculate_reaction_time_errors(times, decays, test_times, reaction_times, decay_offsets, reading_time, F):
+    # type: ([int], [float], [int], [float], [float], float, float) -> np.ndarray
+    """
+    Calculate the summed absolute difference between observed and predicted reaction times for a number of decay adjustments at once.
+    The activation at each test time is based on the encounters before that time, with every encounter's decay shifted by the adjustment.
+    Returns one total error per decay adjustment.
+    """
+    times = np.asarray(times, dtype = np.float64)
+    decays = np.asarray(decays, dtype = np.float64)
+    test_times = np.asarray(test_times, dtype = np.float64)
+    decay_offsets = np.asarray(decay_offsets, dtype = np.float64)
+
+    # Elapsed time between each test time (rows) and each encounter (columns)
+    included = times[np.newaxis, :] < test_times[:, np.newaxis]
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        log_elapsed = np.log(np.where(included, (test_times[:, np.newaxis] - times[np.newaxis, :]) / 1000, 1.0))
+
+    # Activations for every decay adjustment (first axis) at every test time (second axis)
+    adjusted_decays = decays[np.newaxis, :] + decay_offsets[:, np.newaxis]
+    terms = np.where(included[np.newaxis, :, :], -adjusted_decays[:, np.newaxis, :] * log_elapsed[np.newaxis, :, :], -np.inf)
+    max_terms = terms.max(axis = 2)
+    shift = np.where(max_terms > -np.inf, max_terms, 0.0)
+
+    with np.errstate(divide = "ignore", over = "ignore", invalid = "ignore"):
+        activations = np.log(np.exp(terms - shift[:, :, np.newaxis]).sum(axis = 2)) + shift
+        predicted_rts = (F * np.exp(-activations) + (reading_time / 1000)) * 1000
+        return(np.abs(np.asarray(reaction_times, dtype = np.float64)[np.newaxis, :] - predicted_rts).sum(axis = 1))
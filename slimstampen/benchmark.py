@@ -0,0 +1,231 @@
+"""
+Benchmark suite for the spacing model.
+
+Runs synthetic learning sessions and a replay of a logged session, and reports the p50/p99 latency of the main SpacingModel operations and the peak memory use as the session grows.
+Results are written to a JSON file, which can be compared against the results of an earlier run.
+
+Usage:
+    python -m slimstampen.benchmark --facts 1000 --responses 5000 --output benchmark.json
+    python -m slimstampen.benchmark --compare previous_benchmark.json
+"""
+from __future__ import division
+import argparse
+import io
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from .spacingmodel import SpacingModel, Fact, Response
+
+OPERATIONS = ("get_next_fact", "register_response", "calculate_activation", "get_rate_of_forgetting", "export_data")
+
+WORDS = ("the", "capital", "of", "country", "river", "city", "mountain", "largest", "language", "currency", "flag", "island")
+
+
+def generate_deck(n_facts, seed = 0):
+    # type: (int, int) -> [Fact]
+    """
+    Generate a deck of facts with questions of varying length.
+    """
+    rnd = random.Random(seed)
+    return([Fact(i + 1, " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 6))), "answer {}".format(i + 1)) for i in range(n_facts)])
+
+
+def generate_response(rnd, fact, start_time, correct_rate):
+    # type: (random.Random, Fact, int, float) -> Response
+    """
+    Generate a plausible response to a fact.
+    """
+    correct = rnd.random() < correct_rate
+    rt = int(rnd.lognormvariate(7.3, 0.5)) if correct else int(rnd.uniform(2000, 15000))
+    return(Response(fact, start_time, rt, correct))
+
+
+def percentiles(latencies):
+    # type: ([float]) -> dict
+    latencies = np.asarray(latencies) * 1000
+    return({
+        "count": int(len(latencies)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99))
+    })
+
+
+def run_session(n_facts, n_responses, correct_rate, checkpoints, scheduler, seed, trace_memory = False):
+    # type: (int, int, float, [int], str, int, bool) -> [dict]
+    """
+    Simulate a learning session and time every model operation.
+    Latencies are aggregated per interval between checkpoints (numbers of registered responses), so that their growth with session length is visible.
+    """
+    rnd = random.Random(seed)
+    model = SpacingModel(scheduler = scheduler)
+    model.add_facts(generate_deck(n_facts, seed))
+
+    if trace_memory:
+        tracemalloc.start()
+
+    results = []
+    latencies = dict((operation, []) for operation in OPERATIONS)
+    current_time = 0
+    checkpoints = sorted(set(c for c in checkpoints if c <= n_responses) | set([n_responses]))
+
+    for i in range(1, n_responses + 1):
+        current_time += rnd.randint(1000, 5000)
+
+        start = time.perf_counter()
+        fact, new = model.get_next_fact(current_time)
+        latencies["get_next_fact"].append(time.perf_counter() - start)
+
+        response = generate_response(rnd, fact, current_time, correct_rate)
+        start = time.perf_counter()
+        model.register_response(response)
+        latencies["register_response"].append(time.perf_counter() - start)
+        current_time += response.rt
+
+        probe = model.facts[rnd.randrange(len(model.facts))]
+        start = time.perf_counter()
+        model.calculate_activation(current_time, probe)
+        latencies["calculate_activation"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        model.get_rate_of_forgetting(current_time, probe)
+        latencies["get_rate_of_forgetting"].append(time.perf_counter() - start)
+
+        if i in checkpoints:
+            start = time.perf_counter()
+            model.export_data()
+            latencies["export_data"].append(time.perf_counter() - start)
+
+            result = {"responses": i}
+            for operation in OPERATIONS:
+                result[operation] = percentiles(latencies[operation]) if latencies[operation] else None
+            if trace_memory:
+                result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+            results.append(result)
+            latencies = dict((operation, []) for operation in OPERATIONS)
+
+    if trace_memory:
+        tracemalloc.stop()
+
+    return(results)
+
+
+def replay_data(path):
+    # type: (str) -> dict
+    """
+    Replay a logged session (in the format of SpacingModel.export_data) and time every model operation.
+    The alphas of the replayed model are compared with the logged ones.
+    """
+    dat = pd.read_csv(path)
+    model = SpacingModel()
+    facts = {}
+    for row in dat.drop_duplicates("fact_id").itertuples():
+        facts[row.fact_id] = Fact(row.fact_id, row.question, row.answer)
+    model.add_facts(facts.values())
+
+    latencies = dict((operation, []) for operation in OPERATIONS)
+    for row in dat.itertuples():
+        start = time.perf_counter()
+        model.get_next_fact(row.start_time)
+        latencies["get_next_fact"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        model.register_response(Response(facts[row.fact_id], row.start_time, row.rt, bool(row.correct)))
+        latencies["register_response"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        model.calculate_activation(row.start_time + row.rt, facts[row.fact_id])
+        latencies["calculate_activation"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        model.get_rate_of_forgetting(row.start_time + 1, facts[row.fact_id])
+        latencies["get_rate_of_forgetting"].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    exported = pd.read_csv(io.StringIO(model.export_data()))
+    latencies["export_data"].append(time.perf_counter() - start)
+
+    result = {"path": path, "responses": len(dat), "max_alpha_difference": float(np.abs(exported["alpha"] - dat["alpha"]).max()) if len(dat) else 0.0}
+    for operation in OPERATIONS:
+        result[operation] = percentiles(latencies[operation])
+
+    return(result)
+
+
+def compare(results, baseline):
+    # type: (dict, dict) -> [str]
+    """
+    Return a line per scenario, session length and operation with the change in p50 and p99 latency relative to a baseline run.
+    """
+    lines = []
+    for (name, scenario) in results["sessions"].items():
+        previous = dict((r["responses"], r) for r in baseline.get("sessions", {}).get(name, []))
+        for result in scenario:
+            if result["responses"] not in previous:
+                continue
+            for operation in OPERATIONS:
+                new = result[operation]
+                old = previous[result["responses"]][operation]
+                if new is None or old is None:
+                    continue
+                lines.append("{:<10} {:>8} {:<24} p50 {:>9.3f} ms ({:+.0%})  p99 {:>9.3f} ms ({:+.0%})".format(
+                    name, result["responses"], operation,
+                    new["p50_ms"], new["p50_ms"] / old["p50_ms"] - 1 if old["p50_ms"] else 0,
+                    new["p99_ms"], new["p99_ms"] / old["p99_ms"] - 1 if old["p99_ms"] else 0))
+
+    return(lines)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Benchmark the spacing model")
+    parser.add_argument("--facts", type = int, default = 500, help = "number of facts in the synthetic deck")
+    parser.add_argument("--responses", type = int, default = 2000, help = "number of responses in each synthetic session")
+    parser.add_argument("--correct-rate", type = float, default = 0.8, help = "probability that a synthetic response is correct")
+    parser.add_argument("--checkpoints", type = int, nargs = "+", default = [100, 500, 1000, 2000, 5000, 10000], help = "session lengths at which results are reported")
+    parser.add_argument("--schedulers", nargs = "+", default = list(SpacingModel.SCHEDULERS), choices = SpacingModel.SCHEDULERS)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--data", default = "data.csv", help = "logged session to replay, or an empty string to skip the replay")
+    parser.add_argument("--output", default = "benchmark.json", help = "file to write the results to")
+    parser.add_argument("--compare", help = "results of an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    results = {
+        "config": vars(args),
+        "environment": {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__, "machine": platform.machine(), "platform": platform.platform()},
+        "sessions": {}
+    }
+
+    for scheduler in args.schedulers:
+        print("Running {} session with {} facts and {} responses".format(scheduler, args.facts, args.responses))
+        sessions = run_session(args.facts, args.responses, args.correct_rate, args.checkpoints, scheduler, args.seed)
+
+        # Memory is traced in a separate run, as tracing slows down every allocation
+        memory = run_session(args.facts, args.responses, args.correct_rate, args.checkpoints, scheduler, args.seed, trace_memory = True)
+        for (result, traced) in zip(sessions, memory):
+            result["peak_memory_bytes"] = traced["peak_memory_bytes"]
+        results["sessions"][scheduler] = sessions
+
+    if args.data:
+        print("Replaying {}".format(args.data))
+        results["replay"] = replay_data(args.data)
+
+    with io.open(args.output, "w", encoding = "UTF-8") as f:
+        f.write(json.dumps(results, indent = 2))
+    print("Results saved at: {}".format(args.output))
+
+    if args.compare:
+        with io.open(args.compare, "r", encoding = "UTF-8") as f:
+            baseline = json.load(f)
+        for line in compare(results, baseline):
+            print(line)
+
+    return(results)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
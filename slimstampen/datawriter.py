@@ -0,0 +1,48 @@
+from __future__ import division
+import csv
+import io
+import os
+
+class DataWriter(object):
+    """
+    Appends one row per response to a csv file as the session progresses, in the same format as SpacingModel.export_data.
+    """
+
+    COLUMNS = ("trial", "start_time", "rt", "correct", "fact_id", "question", "answer", "alpha")
+
+    def __init__(self, path):
+        # type: (str) -> None
+        """
+        Open the specified csv file for appending. A header is written if the file is empty.
+        """
+        write_header = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.path = path
+        self._file = io.open(path, "a", encoding = "UTF-8", newline = "")
+        self._writer = csv.writer(self._file, lineterminator = os.linesep)
+
+        if write_header:
+            self._writer.writerow(self.COLUMNS)
+            self._file.flush()
+
+
+    def write_response(self, trial, response, alpha):
+        # type: (int, Response, float) -> None
+        """
+        Write the row of a single trial and flush it to disk.
+        """
+        fact = response.fact
+        self._writer.writerow((trial, response.start_time, response.rt, response.correct, fact.fact_id, fact.question, fact.answer, alpha))
+        self._file.flush()
+
+
+    def close(self):
+        # type: () -> None
+        self._file.close()
+
+
+    def __enter__(self):
+        return(self)
+
+
+    def __exit__(self, *args):
+        self.close()
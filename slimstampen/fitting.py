@@ -0,0 +1,348 @@
+"""
+Fit the spacing model constants C, F and DEFAULT_ALPHA to logged sessions.
+
+All logs (in the format of SpacingModel.export_data) are loaded once into padded arrays of response sequences, one sequence per fact per log.
+Every candidate parameter vector is then replayed over all sequences at once: the model equations are applied one encounter position at a time, vectorised over candidates and sequences.
+Candidates are split into chunks that are evaluated in a process pool.
+The fit of a candidate is the mean absolute difference between the reaction time predicted from the activation at the start of each repetition and the observed (normalised) reaction time.
+
+Usage:
+    python -m slimstampen.fitting data.csv subject-*.csv --c 0.1,0.5,9 --f 0.5,1.5,11 --alpha 0.2,0.4,9 --output fit.csv
+"""
+from __future__ import division
+import argparse
+import glob
+import itertools
+import multiprocessing
+import sys
+import numpy as np
+import pandas as pd
+
+from .spacingmodel import SpacingModel
+
+PARAMETERS = ("C", "F", "DEFAULT_ALPHA")
+
+# Number of steps of the binary search in SpacingModel.estimate_alpha
+ALPHA_STEPS = 6
+
+# Maximum number of array elements in the largest intermediate array of a block of sequences
+BLOCK_ELEMENTS = 2 ** 23
+
+class SessionLogs(object):
+    """
+    Responses from a number of logged sessions, stored as padded arrays with one row per sequence of responses to a fact within a log.
+    Sequences are sorted from longest to shortest.
+    """
+
+    def __init__(self, paths):
+        # type: ([str]) -> None
+        model = SpacingModel()
+        self.paths = []
+        sequences = []
+        for path in paths:
+            try:
+                dat = pd.read_csv(path)
+            except pd.errors.EmptyDataError:
+                continue
+
+            missing = set(["start_time", "rt", "correct", "fact_id"]) - set(dat.columns)
+            if missing:
+                raise RuntimeError("Error while loading session logs: {} is missing the columns {}".format(path, ", ".join(sorted(missing))))
+
+            self.paths.append(path)
+            for (fact_id, group) in dat.groupby("fact_id", sort = False):
+                question = group["question"].iloc[0] if "question" in group.columns else None
+                sequences.append({
+                    "log": len(self.paths) - 1,
+                    "fact_id": fact_id,
+                    "reading_time": model.get_reading_time(question) if isinstance(question, str) else 300,
+                    "start_time": group["start_time"].to_numpy(dtype = np.float64),
+                    "rt": group["rt"].to_numpy(dtype = np.float64),
+                    "correct": group["correct"].astype(str).str.lower().isin(["true", "1"]).to_numpy(),
+                    "alpha": group["alpha"].to_numpy(dtype = np.float64) if "alpha" in group.columns else np.full(len(group), np.nan)
+                })
+
+        sequences.sort(key = lambda s: -len(s["rt"]))
+        self.n_sequences = len(sequences)
+        self.lengths = np.array([len(s["rt"]) for s in sequences], dtype = np.int64)
+        self.max_length = int(self.lengths.max()) if self.n_sequences else 0
+        self.logs = np.array([s["log"] for s in sequences], dtype = np.int64)
+        self.fact_ids = [s["fact_id"] for s in sequences]
+        self.reading_times = np.array([s["reading_time"] for s in sequences], dtype = np.float64)
+        self.start_times = self._pad(sequences, "start_time", np.inf, np.float64)
+        self.rts = self._pad(sequences, "rt", 0.0, np.float64)
+        self.correct = self._pad(sequences, "correct", False, bool)
+        self.alphas = self._pad(sequences, "alpha", np.nan, np.float64)
+
+
+    @property
+    def n_responses(self):
+        return(int(self.lengths.sum()))
+
+
+    def _pad(self, sequences, name, fill, dtype):
+        # type: ([dict], str, object, type) -> np.ndarray
+        padded = np.full((self.n_sequences, self.max_length), fill, dtype = dtype)
+        for (i, s) in enumerate(sequences):
+            padded[i, :len(s[name])] = s[name]
+
+        return(padded)
+
+
+def replay(logs, C, F, default_alpha, forget_threshold = SpacingModel.FORGET_THRESHOLD):
+    # type: (SessionLogs, np.ndarray, np.ndarray, np.ndarray, float) -> dict
+    """
+    Replay all logged sequences for every candidate parameter vector (C[k], F[k], default_alpha[k]), following the equations of SpacingModel.
+    Returns arrays with one row per candidate and one column per sequence of: the predicted reaction time at the start of each response,
+    the normalised observed reaction time and the rate of forgetting estimated after each response (each padded along the last axis).
+    """
+    C = np.atleast_1d(np.asarray(C, dtype = np.float64))
+    F = np.atleast_1d(np.asarray(F, dtype = np.float64))
+    default_alpha = np.atleast_1d(np.asarray(default_alpha, dtype = np.float64))
+    shape = (len(C), logs.n_sequences, logs.max_length)
+    result = {"predicted_rt": np.full(shape, np.nan), "observed_rt": np.full(shape, np.nan), "alpha": np.full(shape, np.nan)}
+
+    # Process blocks of (candidate, sequence) pairs, sized so that the search over candidate alphas fits in memory
+    pairs = np.array(list(itertools.product(range(logs.n_sequences), range(len(C)))), dtype = np.int64).reshape(-1, 2)
+    start = 0
+    while start < len(pairs):
+        length = int(logs.lengths[pairs[start, 0]])
+        size = max(1, BLOCK_ELEMENTS // ((2 ** ALPHA_STEPS + 1) * 5 * max(length, 1)))
+        end = min(start + size, len(pairs))
+
+        # Keep sequences of the same length together, so that no time is spent on padding
+        end = start + int(np.searchsorted(-logs.lengths[pairs[start:end, 0]], -length, side = "right"))
+        sequence, candidate = pairs[start:end].T
+        block = _replay_block(logs.start_times[sequence, :length], logs.rts[sequence, :length], logs.correct[sequence, :length],
+                              logs.lengths[sequence], logs.reading_times[sequence],
+                              C[candidate], F[candidate], default_alpha[candidate], forget_threshold)
+        for (name, values) in block.items():
+            result[name][candidate, sequence, :length] = values
+        start = end
+
+    return(result)
+
+
+def _replay_block(times, rts, correct, lengths, reading_times, C, F, default_alpha, forget_threshold):
+    # type: (np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, float) -> dict
+    """
+    Replay a block of sequences, each with its own parameters, one encounter position at a time.
+    """
+    n, length = times.shape
+    rows = np.arange(n)
+    max_rt = 1.5 * (F * np.exp(-forget_threshold) + (reading_times / 1000)) * 1000
+    observed_rts = np.minimum(np.where(correct, rts, 60000), max_rt[:, np.newaxis])
+
+    activations = np.full((n, length), -np.inf)
+    decays = np.zeros((n, length))
+    alpha = default_alpha.copy()
+    predicted_rts = np.full((n, length), np.nan)
+    alphas = np.full((n, length), np.nan)
+
+    for j in range(length):
+        valid = j < lengths
+
+        # Activation at the start of the response, based on the preceding encounters
+        activation = _activations(times[:, :j], decays[:, :j], times[:, j:j + 1])[:, 0]
+        with np.errstate(over = "ignore"):
+            predicted_rt = (F * np.exp(-activation) + (reading_times / 1000)) * 1000
+        predicted_rts[:, j] = np.where(valid, predicted_rt, np.nan)
+
+        activations[:, j] = activation
+        decays[:, j] = default_alpha
+        if j + 1 >= 3:
+            new_alpha = _estimate_alpha(times[:, :j + 1], decays[:, :j + 1], observed_rts[:, :j + 1], alpha,
+                                        predicted_rt - observed_rts[:, j], reading_times, F)
+            alpha = np.where(valid, new_alpha, alpha)
+
+        # Update the decay of every encounter with the new rate of forgetting
+        with np.errstate(over = "ignore"):
+            new_decays = C[:, np.newaxis] * np.exp(activations[:, :j + 1]) + alpha[:, np.newaxis]
+        decays[:, :j + 1] = np.where(valid[:, np.newaxis], new_decays, decays[:, :j + 1])
+        alphas[rows[valid], j] = alpha[valid]
+
+    observed_rts[np.arange(length)[np.newaxis, :] >= lengths[:, np.newaxis]] = np.nan
+    return({"predicted_rt": predicted_rts, "observed_rt": observed_rts, "alpha": alphas})
+
+
+def _estimate_alpha(times, decays, observed_rts, previous_alpha, est_diff, reading_times, F):
+    # type: (np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray) -> np.ndarray
+    """
+    Vectorised version of SpacingModel.estimate_alpha for a block of sequences that all have the same number of encounters.
+    """
+    a0 = np.where(est_diff < 0, previous_alpha, previous_alpha - 0.05)
+    a1 = np.where(est_diff < 0, previous_alpha + 0.05, previous_alpha)
+    steps = 2 ** ALPHA_STEPS
+    candidates = a0[:, np.newaxis] + (a1 - a0)[:, np.newaxis] * np.arange(steps + 1) / steps
+
+    # Reaction time errors on the last (up to) five encounters, excluding the first, for every candidate alpha
+    window = slice(max(1, times.shape[1] - 5), times.shape[1])
+    offsets = candidates - previous_alpha[:, np.newaxis]
+    activations = _activations(times, decays[:, np.newaxis, :] + offsets[:, :, np.newaxis], times[:, window] - 100)
+    with np.errstate(over = "ignore", invalid = "ignore"):
+        predicted_rts = (F[:, np.newaxis, np.newaxis] * np.exp(-activations) + (reading_times[:, np.newaxis, np.newaxis] / 1000)) * 1000
+        errors = np.abs(observed_rts[:, np.newaxis, window] - predicted_rts).sum(axis = 2)
+
+    # Binary search between previous fit and proposed alpha
+    rows = np.arange(len(previous_alpha))
+    i0 = np.zeros(len(previous_alpha), dtype = np.int64)
+    i1 = np.full(len(previous_alpha), steps, dtype = np.int64)
+    for _ in range(ALPHA_STEPS):
+        ac = (a0 + a1) / 2
+        ic = (i0 + i1) // 2
+        lower = errors[rows, i0] < errors[rows, i1]
+        a1 = np.where(lower, ac, a1)
+        i1 = np.where(lower, ic, i1)
+        a0 = np.where(lower, a0, ac)
+        i0 = np.where(lower, i0, ic)
+
+    return((a0 + a1) / 2)
+
+
+def _activations(times, decays, test_times):
+    # type: (np.ndarray, np.ndarray, np.ndarray) -> np.ndarray
+    """
+    Calculate activations at a number of test times per sequence, using only the encounters before each test time.
+    Decays have shape (sequences, [adjustments,] encounters) and the result has shape (sequences, [adjustments,] test times).
+    """
+    included = times[:, np.newaxis, :] < test_times[:, :, np.newaxis]
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        log_elapsed = np.log(np.where(included, (test_times[:, :, np.newaxis] - times[:, np.newaxis, :]) / 1000, 1.0))
+
+    if decays.ndim == 3:
+        included = included[:, np.newaxis]
+        log_elapsed = log_elapsed[:, np.newaxis]
+        decays = decays[:, :, np.newaxis, :]
+    else:
+        decays = decays[:, np.newaxis, :]
+
+    terms = np.where(included, -decays * log_elapsed, -np.inf)
+    if terms.shape[-1] == 0:
+        return(np.full(terms.shape[:-1], -np.inf))
+
+    max_terms = terms.max(axis = -1)
+    shift = np.where(max_terms > -np.inf, max_terms, 0.0)
+    with np.errstate(divide = "ignore", over = "ignore", invalid = "ignore"):
+        return(np.log(np.exp(terms - shift[..., np.newaxis]).sum(axis = -1)) + shift)
+
+
+def evaluate(logs, candidates, forget_threshold = SpacingModel.FORGET_THRESHOLD):
+    # type: (SessionLogs, np.ndarray, float) -> pd.DataFrame
+    """
+    Calculate the fit diagnostics of every candidate parameter vector (rows of C, F, DEFAULT_ALPHA).
+    Only repetitions are scored, as the first response to a fact has no activation to predict its reaction time from.
+    """
+    candidates = np.asarray(candidates, dtype = np.float64).reshape(-1, len(PARAMETERS))
+    result = replay(logs, candidates[:, 0], candidates[:, 1], candidates[:, 2], forget_threshold)
+    predicted = result["predicted_rt"]
+    observed = result["observed_rt"]
+    scored = np.isfinite(predicted) & np.isfinite(observed)
+
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        errors = np.where(scored, predicted - observed, 0.0)
+        n = scored.sum(axis = (1, 2))
+        mean_predicted = np.where(scored, predicted, 0.0).sum(axis = (1, 2)) / n
+        mean_observed = np.where(scored, observed, 0.0).sum(axis = (1, 2)) / n
+        centred_predicted = np.where(scored, predicted - mean_predicted[:, np.newaxis, np.newaxis], 0.0)
+        centred_observed = np.where(scored, observed - mean_observed[:, np.newaxis, np.newaxis], 0.0)
+        correlation = (centred_predicted * centred_observed).sum(axis = (1, 2)) / np.sqrt((centred_predicted ** 2).sum(axis = (1, 2)) * (centred_observed ** 2).sum(axis = (1, 2)))
+        final_alphas = result["alpha"][:, np.arange(logs.n_sequences), logs.lengths - 1]
+
+        return(pd.DataFrame({
+            "C": candidates[:, 0],
+            "F": candidates[:, 1],
+            "DEFAULT_ALPHA": candidates[:, 2],
+            "mae": np.abs(errors).sum(axis = (1, 2)) / n,
+            "rmse": np.sqrt((errors ** 2).sum(axis = (1, 2)) / n),
+            "bias": errors.sum(axis = (1, 2)) / n,
+            "correlation": correlation,
+            "n_predictions": n,
+            "mean_alpha": final_alphas.mean(axis = 1),
+            "sd_alpha": final_alphas.std(axis = 1)
+        }))
+
+
+_logs = None
+
+def _init_worker(logs):
+    # type: (SessionLogs) -> None
+    global _logs
+    _logs = logs
+
+
+def _evaluate_chunk(task):
+    # type: ((np.ndarray, float)) -> pd.DataFrame
+    candidates, forget_threshold = task
+    return(evaluate(_logs, candidates, forget_threshold))
+
+
+def fit(logs, candidates, workers = None, chunk_size = 16, forget_threshold = SpacingModel.FORGET_THRESHOLD):
+    # type: (SessionLogs, np.ndarray, int, int, float) -> pd.DataFrame
+    """
+    Evaluate all candidate parameter vectors in a process pool, and return their diagnostics sorted from best to worst fit.
+    The logs are sent to each worker process once.
+    """
+    candidates = np.asarray(candidates, dtype = np.float64).reshape(-1, len(PARAMETERS))
+    if logs.n_responses == 0:
+        raise RuntimeError("Error while fitting parameters: The logs contain no responses")
+
+    tasks = [(candidates[i:i + chunk_size], forget_threshold) for i in range(0, len(candidates), chunk_size)]
+    pool = multiprocessing.Pool(workers, initializer = _init_worker, initargs = (logs,))
+    try:
+        results = pool.map(_evaluate_chunk, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    return(pd.concat(results, ignore_index = True).sort_values("mae", kind = "mergesort").reset_index(drop = True))
+
+
+def parse_range(specification):
+    # type: (str) -> np.ndarray
+    """
+    Parse a range of parameter values given as start,stop,num (inclusive), or a single value.
+    """
+    values = [float(v) for v in specification.split(",")]
+    if len(values) == 1:
+        return(np.array(values))
+    if len(values) != 3:
+        raise RuntimeError("Error while parsing parameter range: Expected start,stop,num but got {}".format(specification))
+
+    return(np.linspace(values[0], values[1], int(values[2])))
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Fit the spacing model constants C, F and DEFAULT_ALPHA to logged sessions")
+    parser.add_argument("paths", nargs = "*", help = "session logs (defaults to data.csv and subject-*.csv)")
+    parser.add_argument("--c", default = "0.05,0.5,10", help = "values of C as start,stop,num")
+    parser.add_argument("--f", default = "0.5,2.0,16", help = "values of F as start,stop,num")
+    parser.add_argument("--alpha", default = "0.2,0.4,9", help = "values of DEFAULT_ALPHA as start,stop,num")
+    parser.add_argument("--workers", type = int, default = None, help = "number of worker processes (defaults to the number of cores)")
+    parser.add_argument("--chunk-size", type = int, default = 16, help = "number of candidates evaluated per task")
+    parser.add_argument("--top", type = int, default = 10, help = "number of best candidates to print")
+    parser.add_argument("--output", default = "fit.csv", help = "file to write the diagnostics of all candidates to")
+    args = parser.parse_args(argv)
+
+    paths = args.paths or (["data.csv"] + sorted(glob.glob("subject-*.csv")))
+    logs = SessionLogs(paths)
+    print("Loaded {} responses in {} sequences from {} logs".format(logs.n_responses, logs.n_sequences, len(logs.paths)))
+
+    candidates = np.array(list(itertools.product(parse_range(args.c), parse_range(args.f), parse_range(args.alpha))))
+    results = fit(logs, candidates, args.workers, args.chunk_size)
+    results.to_csv(args.output, encoding = "UTF-8", index_label = "rank")
+
+    # Check that the replay reproduces the logged rates of forgetting at the current model constants
+    current = replay(logs, SpacingModel.C, SpacingModel.F, SpacingModel.DEFAULT_ALPHA)["alpha"][0]
+    logged = np.isfinite(logs.alphas)
+    if logged.any():
+        print("Largest difference between replayed and logged alpha at the current constants: {:.6g}".format(np.abs(current - logs.alphas)[logged].max()))
+
+    print(results.head(args.top).to_string())
+    best = results.iloc[0]
+    print("Best parameters: C = {:.4g}, F = {:.4g}, DEFAULT_ALPHA = {:.4g} (MAE {:.1f} ms over {} predictions)".format(best["C"], best["F"], best["DEFAULT_ALPHA"], best["mae"], int(best["n_predictions"])))
+    print("Results saved at: {}".format(args.output))
+    return(results)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,323 @@
+from __future__ import division
+import numpy as np
+
+from .spacingmodel import SpacingModel, Response, Encounter
+
+class MultiLearnerSpacingModel(object):
+    """
+    Spacing model for many learners studying the same set of facts.
+    The encounters of all learners are stored in shared columnar arrays, with one entry per response, and the next fact for a whole batch of learners is chosen in a single vectorised call.
+    The equations and constants are those of the given SpacingModel, so every learner is scheduled exactly as by a SpacingModel of their own.
+    Learners that are not known yet are added when they are first used.
+    """
+
+    def __init__(self, model = None, capacity = 1024):
+        # type: (SpacingModel, int) -> None
+        self.model = model if model is not None else SpacingModel()
+        self.facts = []
+        self.learners = []
+        self._fact_index = {}
+        self._learner_index = {}
+        self._start_times = []
+        self._last_facts = []
+
+        # Encounter rows and pairs of each learner, so that a batch only touches the encounters of its own learners
+        self._learner_rows = []
+        self._learner_pairs = []
+
+        # (learner, fact) pairs
+        self._pair_index = {}
+        self.pair_learner = np.zeros(0, dtype = np.int32)
+        self.pair_fact = np.zeros(0, dtype = np.int32)
+        self.pair_alpha = np.zeros(0)
+        self.pair_count = np.zeros(0, dtype = np.int32)
+        self.pair_last_row = np.zeros(0, dtype = np.int64)
+        self.pair_last_time = np.zeros(0)
+        self.n_pairs = 0
+
+        # Encounters, linked to the previous encounter of the same pair
+        self.encounter_learner = np.zeros(capacity, dtype = np.int32)
+        self.encounter_fact = np.zeros(capacity, dtype = np.int32)
+        self.encounter_previous = np.zeros(capacity, dtype = np.int64)
+        self.encounter_time = np.zeros(capacity)
+        self.encounter_activation = np.zeros(capacity)
+        self.encounter_decay = np.zeros(capacity)
+        self.encounter_rt = np.zeros(capacity)
+        self.encounter_correct = np.zeros(capacity, dtype = bool)
+        self.n_encounters = 0
+
+
+    def add_fact(self, fact):
+        # type: (Fact) -> None
+        """
+        Add a fact to the list of study items of all learners.
+        """
+        if fact.fact_id in self._fact_index:
+            raise RuntimeError(
+                "Error while adding fact: There is already a fact with the same ID: {}. Each fact must have a unique ID".format(fact.fact_id))
+
+        self._fact_index[fact.fact_id] = len(self.facts)
+        self.facts.append(fact)
+        self.model._get_fact_state(fact)
+
+
+    def add_learner(self, learner_id):
+        # type: (object) -> int
+        """
+        Add a learner and return their index.
+        """
+        if learner_id in self._learner_index:
+            raise RuntimeError(
+                "Error while adding learner: There is already a learner with the same ID: {}. Each learner must have a unique ID".format(learner_id))
+
+        self._learner_index[learner_id] = len(self.learners)
+        self.learners.append(learner_id)
+        self._start_times.append(set())
+        self._last_facts.append(-1)
+        self._learner_rows.append([])
+        self._learner_pairs.append([])
+        return(self._learner_index[learner_id])
+
+
+    def register_response(self, learner_id, response):
+        # type: (object, Response) -> None
+        """
+        Register a response of a learner.
+        """
+        learner = self._get_learner(learner_id)
+        fact = self._fact_index.get(response.fact.fact_id)
+        if fact is None:
+            raise RuntimeError(
+                "Error while registering response: There is no fact with ID: {}. Facts must be added before responses to them are registered".format(response.fact.fact_id))
+
+        # Prevent duplicate responses
+        if response.start_time in self._start_times[learner]:
+            raise RuntimeError(
+                "Error while registering response: A response has already been logged at this start_time: {}. Each response must occur at a unique start_time.".format(response.start_time))
+
+        self._start_times[learner].add(response.start_time)
+        self._last_facts[learner] = fact
+
+        pair = self._pair_index.get((learner, fact))
+        if pair is None:
+            pair = self._add_pair(learner, fact)
+
+        # Advance the pair by a single encounter, using the same update as SpacingModel
+        rows = self._pair_rows(pair)
+        encounters = [Encounter(self.encounter_activation[r], self.encounter_time[r], self._normalise(r), self.encounter_decay[r]) for r in rows]
+        state = self.model._get_fact_state(response.fact)
+        encounters, alpha = self.model._add_encounter(encounters, self.pair_alpha[pair], response, state)
+
+        row = self._add_encounter_row(learner, fact, pair, response, encounters[-1].activation)
+        self.encounter_decay[rows + [row]] = [e.decay for e in encounters]
+        self.pair_alpha[pair] = alpha
+        self.pair_count[pair] += 1
+        self.pair_last_time[pair] = max(self.pair_last_time[pair], response.start_time)
+
+
+    def get_rate_of_forgetting(self, learner_id, fact):
+        # type: (object, Fact) -> float
+        """
+        Return the current estimate of the rate of forgetting of a learner for a fact.
+        """
+        pair = self._pair_index.get((self._learner_index.get(learner_id), self._fact_index.get(fact.fact_id)))
+        if pair is None:
+            return(self.model.DEFAULT_ALPHA)
+
+        return(float(self.pair_alpha[pair]))
+
+
+    def calculate_activations(self, learner_ids, times):
+        # type: ([object], [int]) -> np.ndarray
+        """
+        Calculate the activation of every fact for each of the learners at the given times.
+        Returns a matrix with one row per learner and one column per fact; facts a learner has not seen before the time have an activation of -inf.
+        A learner can occur more than once in a batch, e.g. at different times.
+        """
+        learners = np.array([self._get_learner(l) for l in learner_ids], dtype = np.int64)
+        times = np.broadcast_to(np.asarray(times, dtype = np.float64), learners.shape)
+        n_facts = len(self.facts)
+        activations = np.full((len(learners), n_facts), -np.inf)
+        if len(learners) == 0 or n_facts == 0:
+            return(activations)
+
+        # Encounter rows of the learners in the batch, with the position in the batch they belong to
+        selected = np.array([row for l in learners for row in self._learner_rows[l]], dtype = np.int64)
+        position = np.repeat(np.arange(len(learners)), [len(self._learner_rows[l]) for l in learners])
+        included = self.encounter_time[selected] < times[position]
+        selected = selected[included]
+        position = position[included]
+
+        # Sum t^-d per (learner, fact) cell with the log-sum-exp trick
+        cells = position * n_facts + self.encounter_fact[selected]
+        terms = -self.encounter_decay[selected] * np.log((times[position] - self.encounter_time[selected]) / 1000)
+        max_terms = np.full(len(learners) * n_facts, -np.inf)
+        np.maximum.at(max_terms, cells, terms)
+        sums = np.bincount(cells, weights = np.exp(terms - max_terms[cells]), minlength = len(max_terms))
+        with np.errstate(divide = "ignore"):
+            activations = (np.log(sums) + np.where(max_terms > -np.inf, max_terms, 0.0)).reshape(len(learners), n_facts)
+
+        # Pairs with an encounter at or after the time need their history replayed
+        pairs = np.array([pair for l in learners for pair in self._learner_pairs[l]], dtype = np.int64)
+        pair_position = np.repeat(np.arange(len(learners)), [len(self._learner_pairs[l]) for l in learners])
+        replay = self.pair_last_time[pairs] >= times[pair_position]
+        for (pair, i) in zip(pairs[replay], pair_position[replay]):
+            activations[i, self.pair_fact[pair]] = self._replay_activation(pair, times[i])
+
+        return(activations)
+
+
+    def get_next_facts(self, learner_ids, current_times):
+        # type: ([object], [int]) -> [(Fact, bool)]
+        """
+        Returns, for each of the learners, a tuple containing the fact that needs to be repeated most urgently and a boolean indicating whether this fact is new (True) or has been presented before (False).
+        If none of a learner's previously studied facts needs to be repeated right now, a new fact is chosen instead.
+        """
+        learners = np.array([self._get_learner(l) for l in learner_ids], dtype = np.int64)
+        lookahead_times = np.asarray(current_times, dtype = np.float64) + self.model.LOOKAHEAD_TIME
+        activations = self.calculate_activations(learner_ids, lookahead_times)
+
+        seen = activations > -np.inf
+        not_seen = ~seen
+
+        # Prevent an immediate repetition of the same fact
+        last_facts = np.array([self._last_facts[l] for l in learners], dtype = np.int64)
+        exclude = np.flatnonzero((seen.sum(axis = 1) > 2) & (last_facts >= 0))
+        seen[exclude, last_facts[exclude]] = False
+
+        # Reinforce the weakest fact with an activation below the threshold
+        seen_activations = np.where(seen, activations, np.inf)
+        reinforce = ~not_seen.any(axis = 1) | (seen_activations < self.model.FORGET_THRESHOLD).any(axis = 1)
+        weakest_facts = seen_activations.argmin(axis = 1)
+
+        # If none of the previously seen facts has an activation below the threshold, choose a new fact
+        new_facts = not_seen.argmax(axis = 1)
+
+        choices = []
+        for (i, learner_id) in enumerate(learner_ids):
+            if reinforce[i]:
+                if not seen[i].any():
+                    raise RuntimeError(
+                        "Error while choosing next fact: There are no facts to choose from for learner: {}".format(learner_id))
+                choices.append((self.facts[weakest_facts[i]], False))
+            else:
+                choices.append((self.facts[new_facts[i]], True))
+
+        return(choices)
+
+
+    def get_next_fact(self, learner_id, current_time):
+        # type: (object, int) -> (Fact, bool)
+        """
+        Returns the next fact for a single learner. See get_next_facts.
+        """
+        return(self.get_next_facts([learner_id], [current_time])[0])
+
+
+    def _get_learner(self, learner_id):
+        # type: (object) -> int
+        """
+        Return the index of a learner, adding learners that are not known yet.
+        """
+        learner = self._learner_index.get(learner_id)
+        if learner is None:
+            learner = self.add_learner(learner_id)
+
+        return(learner)
+
+
+    def _add_pair(self, learner, fact):
+        # type: (int, int) -> int
+        pair = self.n_pairs
+        if pair == len(self.pair_learner):
+            size = max(2 * pair, 64)
+            self.pair_learner = _grow(self.pair_learner, size)
+            self.pair_fact = _grow(self.pair_fact, size)
+            self.pair_alpha = _grow(self.pair_alpha, size)
+            self.pair_count = _grow(self.pair_count, size)
+            self.pair_last_row = _grow(self.pair_last_row, size)
+            self.pair_last_time = _grow(self.pair_last_time, size)
+
+        self.pair_learner[pair] = learner
+        self.pair_fact[pair] = fact
+        self.pair_alpha[pair] = self.model.DEFAULT_ALPHA
+        self.pair_count[pair] = 0
+        self.pair_last_row[pair] = -1
+        self.pair_last_time[pair] = -np.inf
+        self._pair_index[(learner, fact)] = pair
+        self._learner_pairs[learner].append(pair)
+        self.n_pairs += 1
+        return(pair)
+
+
+    def _add_encounter_row(self, learner, fact, pair, response, activation):
+        # type: (int, int, int, Response, float) -> int
+        row = self.n_encounters
+        if row == len(self.encounter_time):
+            size = max(2 * row, 1024)
+            for name in ("learner", "fact", "previous", "time", "activation", "decay", "rt", "correct"):
+                setattr(self, "encounter_" + name, _grow(getattr(self, "encounter_" + name), size))
+
+        self.encounter_learner[row] = learner
+        self.encounter_fact[row] = fact
+        self.encounter_previous[row] = self.pair_last_row[pair]
+        self.encounter_time[row] = response.start_time
+        self.encounter_activation[row] = activation
+        self.encounter_rt[row] = response.rt
+        self.encounter_correct[row] = response.correct
+        self.pair_last_row[pair] = row
+        self._learner_rows[learner].append(row)
+        self.n_encounters += 1
+        return(row)
+
+
+    def _pair_rows(self, pair):
+        # type: (int) -> [int]
+        """
+        Return the encounter rows of a pair in the order in which they were registered.
+        """
+        rows = []
+        row = self.pair_last_row[pair]
+        while row >= 0:
+            rows.append(int(row))
+            row = self.encounter_previous[row]
+
+        return(rows[::-1])
+
+
+    def _pair_responses(self, pair):
+        # type: (int) -> [Response]
+        fact = self.facts[self.pair_fact[pair]]
+        return([Response(fact, self.encounter_time[r], self.encounter_rt[r], bool(self.encounter_correct[r])) for r in self._pair_rows(pair)])
+
+
+    def _normalise(self, row):
+        # type: (int) -> float
+        rt = self.encounter_rt[row] if self.encounter_correct[row] else 60000
+        return(min(rt, self.model._get_fact_state(self.facts[self.encounter_fact[row]]).max_rt))
+
+
+    def _replay_activation(self, pair, time):
+        # type: (int, float) -> float
+        """
+        Calculate the activation of a pair at the given time from the responses before that time.
+        """
+        fact = self.facts[self.pair_fact[pair]]
+        state = self.model._get_fact_state(fact)
+        encounters = []
+        alpha = self.model.DEFAULT_ALPHA
+        for response in self._pair_responses(pair):
+            if response.start_time < time:
+                encounters, alpha = self.model._add_encounter(encounters, alpha, response, state)
+
+        return(self.model.calculate_activation_from_encounters(encounters, time))
+
+
+def _grow(array, size):
+    # type: (np.ndarray, int) -> np.ndarray
+    """
+    Return a copy of the array extended to the given size.
+    """
+    grown = np.zeros(size, dtype = array.dtype)
+    grown[:len(array)] = array
+    return(grown)
@@ -0,0 +1,268 @@
+from __future__ import division
+import io
+import json
+import os
+import numpy as np
+
+from .spacingmodel import Fact, Response
+
+class ResponseLog(object):
+    """
+    Compact store of responses that can be used instead of a list of Response tuples, e.g. as SpacingModel.responses.
+    Responses are kept as typed columns (fact index, start_time, rt, correct) next to a table of facts.
+    If a path is given, the columns are memory-mapped from that file, so that a long history can be opened without reading or parsing it.
+    The fact table is stored next to it, with one JSON-encoded fact per line, in a file with the same name plus ".facts".
+    Start times and reaction times are stored as 64-bit floats, so fractional milliseconds are kept exactly; whole numbers are returned as ints.
+    """
+
+    MAGIC = b"SSRESLOG"
+    VERSION = 2
+    HEADER_SIZE = 64
+
+    # Columns in the order in which they are laid out in the file; 8-byte columns come first to keep every column aligned
+    COLUMNS = (("start_time", np.dtype("<f8")), ("rt", np.dtype("<f8")), ("fact", np.dtype("<i4")), ("correct", np.dtype("u1")))
+
+    def __init__(self, path = None, capacity = 1024):
+        # type: (str, int) -> None
+        """
+        Create an in-memory log, or open the log at the specified path (creating it if it does not exist).
+        """
+        self.path = path
+        self.facts = []
+        self._fact_index = {}
+        self._buffer = None
+
+        if path is None:
+            self._count = 0
+            self._columns = dict((name, np.zeros(capacity, dtype = dtype)) for (name, dtype) in self.COLUMNS)
+            return
+
+        if os.path.exists(path):
+            self._open(path)
+            self._read_facts()
+        else:
+            self._create(path, capacity)
+
+
+    def __len__(self):
+        return(self._count)
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return([self[i] for i in range(*index.indices(self._count))])
+
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("ResponseLog index out of range")
+
+        return(Response(self.facts[self._columns["fact"][index]],
+                        _number(self._columns["start_time"][index]),
+                        _number(self._columns["rt"][index]),
+                        bool(self._columns["correct"][index])))
+
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield(self[i])
+
+
+    @property
+    def capacity(self):
+        return(len(self._columns["start_time"]))
+
+
+    @property
+    def fact_indices(self):
+        return(self._columns["fact"][:self._count])
+
+
+    @property
+    def start_times(self):
+        return(self._columns["start_time"][:self._count])
+
+
+    @property
+    def rts(self):
+        return(self._columns["rt"][:self._count])
+
+
+    @property
+    def correct(self):
+        return(self._columns["correct"][:self._count].view(bool))
+
+
+    def append(self, response):
+        # type: (Response) -> None
+        """
+        Add a response to the end of the log.
+        """
+        fact = self._fact_index.get(response.fact.fact_id)
+        if fact is None:
+            fact = self.add_fact(response.fact)
+
+        if self._count == self.capacity:
+            self._grow(2 * self.capacity)
+
+        i = self._count
+        self._columns["start_time"][i] = response.start_time
+        self._columns["rt"][i] = response.rt
+        self._columns["fact"][i] = fact
+        self._columns["correct"][i] = response.correct
+        self._set_count(i + 1)
+
+
+    def extend(self, responses):
+        # type: ([Response]) -> None
+        for response in responses:
+            self.append(response)
+
+
+    def add_fact(self, fact):
+        # type: (Fact) -> int
+        """
+        Add a fact to the fact table and return its index.
+        """
+        index = self._fact_index.get(fact.fact_id)
+        if index is not None:
+            return(index)
+
+        index = len(self.facts)
+        self.facts.append(Fact(*fact))
+        self._fact_index[fact.fact_id] = index
+        if self.path is not None:
+            with io.open(self.path + ".facts", "a", encoding = "UTF-8") as f:
+                f.write(json.dumps(list(fact), ensure_ascii = False) + "\n")
+
+        return(index)
+
+
+    def flush(self):
+        # type: () -> None
+        if self._buffer is not None:
+            self._buffer.flush()
+
+
+    def close(self):
+        # type: () -> None
+        """
+        Flush the log to disk and release the memory map.
+        """
+        if self._buffer is not None:
+            self._buffer.flush()
+            self._columns = dict((name, np.zeros(0, dtype = dtype)) for (name, dtype) in self.COLUMNS)
+            self._header = None
+            self._buffer = None
+
+
+    def _create(self, path, capacity):
+        # type: (str, int) -> None
+        with io.open(path, "wb") as f:
+            f.write(self._header_bytes(0, capacity))
+            f.truncate(self._file_size(capacity))
+
+        io.open(path + ".facts", "w", encoding = "UTF-8").close()
+        self._open(path)
+
+
+    def _open(self, path):
+        # type: (str) -> None
+        with io.open(path, "rb") as f:
+            header = f.read(self.HEADER_SIZE)
+
+        if len(header) < self.HEADER_SIZE or header[:len(self.MAGIC)] != self.MAGIC:
+            raise RuntimeError("Error while opening response log: {} is not a response log".format(path))
+
+        version, count, capacity = np.frombuffer(header, dtype = "<u8", count = 3, offset = len(self.MAGIC))
+        if version != self.VERSION:
+            raise RuntimeError("Error while opening response log: Unsupported version {} in {}".format(version, path))
+
+        self._map(path, int(capacity))
+        self._count = int(count)
+
+
+    def _map(self, path, capacity):
+        # type: (str, int) -> None
+        """
+        Memory-map the file and create the column views.
+        """
+        self._buffer = np.memmap(path, dtype = np.uint8, mode = "r+", shape = (self._file_size(capacity),))
+        self._header = self._buffer[:self.HEADER_SIZE].view("<u8")
+        self._columns = {}
+        for (name, dtype, offset) in self._layout(capacity):
+            self._columns[name] = self._buffer[offset:offset + capacity * dtype.itemsize].view(dtype)
+
+
+    def _set_count(self, count):
+        # type: (int) -> None
+        self._count = count
+        if self._buffer is not None:
+            self._header[2] = count
+
+
+    def _grow(self, capacity):
+        # type: (int) -> None
+        """
+        Increase the capacity of the columns.
+        """
+        if self._buffer is None:
+            for (name, dtype) in self.COLUMNS:
+                column = np.zeros(capacity, dtype = dtype)
+                column[:self._count] = self._columns[name][:self._count]
+                self._columns[name] = column
+            return
+
+        # Extend the file and move the columns to their new offsets, starting with the last column so that no data is overwritten before it has been moved
+        old_layout = self._layout(self.capacity)
+        self._buffer.flush()
+        self._columns = self._header = self._buffer = None
+        with io.open(self.path, "r+b") as f:
+            f.truncate(self._file_size(capacity))
+
+        self._map(self.path, capacity)
+        for (name, dtype, old_offset), (_, _, new_offset) in reversed(list(zip(old_layout, self._layout(capacity)))):
+            size = self._count * dtype.itemsize
+            self._buffer[new_offset:new_offset + size] = self._buffer[old_offset:old_offset + size].copy()
+
+        self._header[:] = np.frombuffer(self._header_bytes(self._count, capacity), dtype = "<u8")
+        self._buffer.flush()
+
+
+    def _layout(self, capacity):
+        # type: (int) -> [(str, np.dtype, int)]
+        layout = []
+        offset = self.HEADER_SIZE
+        for (name, dtype) in self.COLUMNS:
+            layout.append((name, dtype, offset))
+            offset += capacity * dtype.itemsize
+
+        return(layout)
+
+
+    def _file_size(self, capacity):
+        # type: (int) -> int
+        return(self.HEADER_SIZE + capacity * sum([dtype.itemsize for (_, dtype) in self.COLUMNS]))
+
+
+    def _header_bytes(self, count, capacity):
+        # type: (int, int) -> bytes
+        values = np.array([self.VERSION, count, capacity], dtype = "<u8").tobytes()
+        return((self.MAGIC + values).ljust(self.HEADER_SIZE, b"\0"))
+
+
+    def _read_facts(self):
+        # type: () -> None
+        with io.open(self.path + ".facts", "r", encoding = "UTF-8") as f:
+            self.facts = [Fact(*json.loads(line)) for line in f if line.strip()]
+
+        self._fact_index = dict((fact.fact_id, i) for (i, fact) in enumerate(self.facts))
+
+
+def _number(value):
+    # type: (np.float64) -> float
+    """
+    Return a stored time as an int if it is a whole number and as a float otherwise, so that integer times are returned unchanged.
+    """
+    value = float(value)
+    return(int(value) if value.is_integer() else value)
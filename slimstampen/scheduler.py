@@ -0,0 +1,134 @@
+from __future__ import division
+import heapq
+import math
+
+class ThresholdScheduler(object):
+    """
+    Schedules facts by the predicted time at which their activation drops below the forgetting threshold.
+    Between encounters the activation of a fact decays monotonically, so this time only changes when the fact receives a new response.
+    Rather than rescoring every fact on each trial, the scheduler keeps these times in a heap and only evaluates the facts that may have crossed the threshold.
+    Facts whose predicted crossing has passed leave the heap for a set of crossed facts, where they stay until their next encounter, so each crossing is popped only once.
+    """
+
+    # Furthest time ahead (in ms) for which a threshold crossing is predicted
+    HORIZON = 10 ** 12
+
+    # Safety margin that keeps floating point error from placing a crossing too late
+    MARGIN = 1e-9
+
+    def __init__(self, engine, threshold):
+        self.engine = engine
+        self.threshold = threshold
+        self.versions = []
+        self.crossings = []
+        self.crossed = set()
+        self.unseen = []
+        self.n_seen = 0
+        self.latest_time = -float("inf")
+
+
+    def add_row(self, row):
+        # type: (int) -> None
+        """
+        Start tracking a newly added fact.
+        """
+        self.versions.append(0)
+        heapq.heappush(self.unseen, row)
+
+
+    def update_row(self, row):
+        # type: (int) -> None
+        """
+        Predict the threshold crossing of a fact after its encounters have changed in the activation engine.
+        """
+        n = self.engine.counts[row]
+        if n == 0:
+            return
+
+        if self.versions[row] == 0:
+            self.n_seen += 1
+
+        times = self.engine.times[row, :n].tolist()
+        decays = self.engine.decays[row, :n].tolist()
+        self.latest_time = max(self.latest_time, max(times))
+
+        # Outdated heap entries of this fact are recognised by their version and skipped later on
+        self.versions[row] += 1
+        self.crossed.discard(row)
+        heapq.heappush(self.crossings, (self._predict_crossing(times, decays), self.versions[row], row))
+
+        if len(self.crossings) > 4 * len(self.versions):
+            self.crossings = [entry for entry in self.crossings if entry[1] == self.versions[entry[2]]]
+            heapq.heapify(self.crossings)
+
+
+    def select(self, time, last_row):
+        # type: (int, int) -> (int, bool)
+        """
+        Return the row of the fact to present at the given (lookahead) time and whether it is new.
+        Returns None if the choice requires the activations of all facts, e.g. when every fact has been seen and none has dropped below the threshold.
+        """
+        # Encounters at or after this time call for a replay of those facts' histories
+        if self.latest_time >= time:
+            return(None)
+
+        # Prevent an immediate repetition of the same fact
+        exclude = last_row if self.n_seen > 2 else -1
+
+        # Move the facts that may have dropped below the threshold by now to the crossed facts
+        while self.crossings and self.crossings[0][0] < time:
+            (_, version, row) = heapq.heappop(self.crossings)
+            if version == self.versions[row]:
+                self.crossed.add(row)
+
+        # The crossed facts are scored in a single vectorised call
+        rows = sorted(row for row in self.crossed if row != exclude)
+        if rows:
+            activations = self.engine.calculate_activations(time, rows)
+            if (activations < self.threshold).any():
+                # Facts that have not crossed are all above the threshold, so the weakest fact is among the crossed facts
+                return((rows[int(activations.argmin())], False))
+
+        # Otherwise, present the first fact that has not been seen yet
+        while self.unseen and self.engine.counts[self.unseen[0]] > 0:
+            heapq.heappop(self.unseen)
+
+        if self.unseen:
+            return((self.unseen[0], True))
+
+        return(None)
+
+
+    def _predict_crossing(self, times, decays):
+        # type: ([float], [float]) -> float
+        """
+        Return a time up to which the activation is guaranteed to stay at or above the threshold.
+        """
+        # Activation is only monotonic if every encounter decays
+        if min(decays) <= 0:
+            return(-float("inf"))
+
+        def above_threshold(t):
+            activation = math.log(sum([math.pow((t - e_time) / 1000, -decay) for (e_time, decay) in zip(times, decays)]))
+            return(activation >= self.threshold + self.MARGIN)
+
+        # Expand the search window until the activation has dropped below the threshold
+        start = max(times)
+        lower = start
+        step = 1000
+        while above_threshold(start + step):
+            lower = start + step
+            step *= 2
+            if step > self.HORIZON:
+                return(float("inf"))
+
+        # Narrow down the crossing to the millisecond
+        upper = start + step
+        while upper - lower > 1:
+            middle = (lower + upper) / 2
+            if above_threshold(middle):
+                lower = middle
+            else:
+                upper = middle
+
+        return(lower)
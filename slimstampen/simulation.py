@@ -0,0 +1,219 @@
+"""
+Simulated learners for evaluating spacing model constants before they are deployed.
+
+Each simulated learner has a true rate of forgetting per fact and remembers and responds according to the same ACT-R equations that the model uses.
+A learner studies the deck for one session, scheduled by a SpacingModel with the constants under evaluation, after which their retention is measured.
+The learner population is split into shards that are simulated in a process pool.
+
+Usage:
+    python -m slimstampen.simulation --learners 1000 --grid FORGET_THRESHOLD=-0.9,-0.8,-0.7 LOOKAHEAD_TIME=10000,15000,20000 --output simulation.csv
+"""
+from __future__ import division
+import argparse
+import itertools
+import math
+import multiprocessing
+import random
+import sys
+import pandas as pd
+
+from .spacingmodel import SpacingModel, Response
+from .benchmark import generate_deck
+
+CONSTANTS = ("LOOKAHEAD_TIME", "FORGET_THRESHOLD", "DEFAULT_ALPHA", "C", "F")
+
+class SimulatedLearner(object):
+    """
+    Learner whose memory follows the ACT-R equations of the spacing model, with a true rate of forgetting per fact.
+    """
+
+    # True parameters of the learner's memory
+    C = 0.25
+    F = 1.0
+    ALPHA_MEAN = 0.3
+    ALPHA_SD = 0.08
+    RETRIEVAL_THRESHOLD = -0.8
+    RETRIEVAL_NOISE = 0.25
+
+    def __init__(self, facts, seed):
+        # type: ([Fact], int) -> None
+        self.rnd = random.Random(seed)
+        self.alphas = dict((fact.fact_id, min(max(self.rnd.gauss(self.ALPHA_MEAN, self.ALPHA_SD), 0.05), 0.8)) for fact in facts)
+        self.encounters = dict((fact.fact_id, []) for fact in facts)
+
+
+    def activation(self, fact, time):
+        # type: (Fact, int) -> float
+        """
+        Calculate the true activation of a fact at the given time.
+        """
+        encounters = [(t, d) for (t, d) in self.encounters[fact.fact_id] if t < time]
+        if len(encounters) == 0:
+            return(-float("inf"))
+
+        return(math.log(sum([math.pow((time - t) / 1000, -d) for (t, d) in encounters])))
+
+
+    def recall_probability(self, fact, time):
+        # type: (Fact, int) -> float
+        activation = self.activation(fact, time)
+        if activation == -float("inf"):
+            return(0.0)
+
+        return(1 / (1 + math.exp(-(activation - self.RETRIEVAL_THRESHOLD) / self.RETRIEVAL_NOISE)))
+
+
+    def respond(self, fact, time, new, reading_time):
+        # type: (Fact, int, bool, float) -> Response
+        """
+        Respond to a presentation of a fact and store the encounter.
+        A new fact is shown together with its answer, so it is always answered correctly.
+        """
+        activation = self.activation(fact, time)
+        if new:
+            correct = True
+            rt = int(reading_time + self.rnd.lognormvariate(7.0, 0.3))
+        elif self.rnd.random() < self.recall_probability(fact, time):
+            correct = True
+            rt = int((self.F * math.exp(-activation) + reading_time / 1000) * 1000 + self.rnd.lognormvariate(5.5, 0.5))
+        else:
+            correct = False
+            rt = int(self.rnd.uniform(3000, 10000))
+
+        # The encounter decays according to the activation at the time of the encounter
+        decay = self.C * math.exp(activation) + self.alphas[fact.fact_id]
+        self.encounters[fact.fact_id].append((time, decay))
+        return(Response(fact, time, rt, correct))
+
+
+def simulate_learner(constants, n_facts, seed, session_duration = 600000, feedback_duration = 1500, retention_interval = 300000, scheduler = "scan"):
+    # type: (dict, int, int, int, int, int, str) -> dict
+    """
+    Simulate a single learner studying a deck for one session, scheduled by a SpacingModel with the given constants.
+    Returns the learner's statistics; retention is measured retention_interval ms after the end of the session.
+    The default of 5 minutes (a delayed test after a short break) is long enough to separate good schedules from poor ones, but short enough that recall has not dropped to near zero for every schedule, as it has after a day with the default learner parameters.
+    """
+    model_class = type("SimulatedSpacingModel", (SpacingModel,), dict(constants))
+    model = model_class(scheduler = scheduler)
+    deck = generate_deck(n_facts, seed = 0)
+    model.add_facts(deck)
+    learner = SimulatedLearner(deck, seed)
+
+    time = 0
+    trials = 0
+    correct = 0
+    while time < session_duration:
+        fact, new = model.get_next_fact(time)
+        response = learner.respond(fact, time, new, model.get_reading_time(fact.question))
+        model.register_response(response)
+        trials += 1
+        correct += response.correct and not new
+        time += response.rt + feedback_duration
+
+    studied = [fact for fact in deck if learner.encounters[fact.fact_id]]
+    test_time = time + retention_interval
+    recall = [learner.recall_probability(fact, test_time) for fact in studied]
+    session_recall = [learner.recall_probability(fact, time) for fact in studied]
+
+    return({
+        "seed": seed,
+        "trials": trials,
+        "accuracy": correct / max(trials - len(studied), 1),
+        "facts_studied": len(studied),
+        "coverage": len(studied) / len(deck),
+        "session_end_retention": sum(session_recall) / max(len(studied), 1),
+        "retention": sum(recall) / max(len(studied), 1),
+        "deck_retention": sum(recall) / len(deck)
+    })
+
+
+def _simulate_shard(task):
+    # type: ((int, dict, [int], dict)) -> [dict]
+    index, constants, seeds, options = task
+    results = []
+    for seed in seeds:
+        result = simulate_learner(constants, seed = seed, **options)
+        result["parameter_set"] = index
+        results.append(result)
+
+    return(results)
+
+
+def run_sweep(parameter_sets, n_learners = 1000, n_facts = 40, workers = None, shard_size = 50, seed = 0, **options):
+    # type: ([dict], int, int, int, int, int) -> (pd.DataFrame, pd.DataFrame)
+    """
+    Simulate a population of learners for each set of model constants, sharding the learners over a process pool.
+    The same learners (with the same true rates of forgetting) are simulated for every parameter set, so that differences between sets are not due to sampling.
+    Returns a summary with the mean and standard deviation of every statistic per parameter set, and the statistics of all individual learners.
+    """
+    parameter_sets = [dict(p) for p in parameter_sets]
+    for constants in parameter_sets:
+        unknown = set(constants) - set(CONSTANTS)
+        if unknown:
+            raise RuntimeError("Error while running simulation: Unknown model constants: {}".format(", ".join(sorted(unknown))))
+
+    rnd = random.Random(seed)
+    seeds = [rnd.getrandbits(32) for _ in range(n_learners)]
+    shards = [seeds[i:i + shard_size] for i in range(0, n_learners, shard_size)]
+    options["n_facts"] = n_facts
+    tasks = [(index, constants, shard, options) for (index, constants) in enumerate(parameter_sets) for shard in shards]
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        results = [r for shard in pool.imap_unordered(_simulate_shard, tasks) for r in shard]
+    finally:
+        pool.close()
+        pool.join()
+
+    learners = pd.DataFrame(results).sort_values(["parameter_set", "seed"]).reset_index(drop = True)
+    statistics = [c for c in learners.columns if c not in ("parameter_set", "seed")]
+    summary = learners.groupby("parameter_set")[statistics].agg(["mean", "std"])
+    summary.columns = ["{}_{}".format(statistic, aggregate) for (statistic, aggregate) in summary.columns]
+
+    # Add the constants of each parameter set, using the model defaults where they were not specified
+    constants = pd.DataFrame([dict((name, p.get(name, getattr(SpacingModel, name))) for name in CONSTANTS) for p in parameter_sets])
+    summary = pd.concat([constants, summary.reset_index(drop = True)], axis = 1)
+    summary.index.name = "parameter_set"
+
+    return((summary, learners))
+
+
+def parse_grid(specification):
+    # type: ([str]) -> [dict]
+    """
+    Expand a list of NAME=value1,value2,... specifications into all combinations of values.
+    """
+    names = []
+    values = []
+    for item in specification:
+        name, _, options = item.partition("=")
+        names.append(name)
+        values.append([float(v) for v in options.split(",")])
+
+    return([dict(zip(names, combination)) for combination in itertools.product(*values)])
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Evaluate spacing model constants with simulated learners")
+    parser.add_argument("--grid", nargs = "*", default = [], help = "values to evaluate per constant, as NAME=value1,value2,...")
+    parser.add_argument("--learners", type = int, default = 1000)
+    parser.add_argument("--facts", type = int, default = 40)
+    parser.add_argument("--session-duration", type = int, default = 600000, help = "session duration in ms")
+    parser.add_argument("--retention-interval", type = int, default = 300000, help = "time between the end of the session and the retention test in ms")
+    parser.add_argument("--scheduler", default = "scan", choices = SpacingModel.SCHEDULERS)
+    parser.add_argument("--workers", type = int, default = None, help = "number of worker processes (defaults to the number of cores)")
+    parser.add_argument("--shard-size", type = int, default = 50, help = "number of learners simulated per task")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--output", default = "simulation.csv", help = "file to write the summary per parameter set to")
+    args = parser.parse_args(argv)
+
+    summary, learners = run_sweep(parse_grid(args.grid), args.learners, args.facts, args.workers, args.shard_size, args.seed,
+                                  session_duration = args.session_duration, retention_interval = args.retention_interval, scheduler = args.scheduler)
+    summary.to_csv(args.output, encoding = "UTF-8")
+    print(summary.sort_values("retention_mean", ascending = False).to_string())
+    print("Results saved at: {}".format(args.output))
+    return(summary)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
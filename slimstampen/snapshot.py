@@ -0,0 +1,195 @@
+from __future__ import division
+import io
+import json
+import struct
+import numpy as np
+
+from .spacingmodel import SpacingModel, Fact, Response, Encounter, FactState
+
+# A snapshot consists of the magic bytes, the format version and the length of a JSON header, followed by the header and the binary columns it describes
+MAGIC = b"SSSNAP\0\0"
+VERSION = 1
+
+CONSTANTS = ("LOOKAHEAD_TIME", "FORGET_THRESHOLD", "DEFAULT_ALPHA", "C", "F")
+
+# Binary columns in the order in which they are stored, with their type and the header count that gives their length
+COLUMNS = (
+    ("response_fact", "<i4", "n_responses"),
+    ("response_start_time", "<f8", "n_responses"),
+    ("response_start_time_is_int", "u1", "n_responses"),
+    ("response_rt", "<f8", "n_responses"),
+    ("response_rt_is_int", "u1", "n_responses"),
+    ("response_correct", "u1", "n_responses"),
+    ("response_alpha", "<f8", "n_responses"),
+    ("state_present", "u1", "n_facts"),
+    ("state_alpha", "<f8", "n_facts"),
+    ("state_reading_time", "<f8", "n_facts"),
+    ("state_reading_time_is_int", "u1", "n_facts"),
+    ("state_max_rt", "<f8", "n_facts"),
+    ("state_last_time", "<f8", "n_facts"),
+    ("state_in_order", "u1", "n_facts"),
+    ("state_count", "<i8", "n_facts"),
+    ("encounter_activation", "<f8", "n_encounters"),
+    ("encounter_time", "<f8", "n_encounters"),
+    ("encounter_time_is_int", "u1", "n_encounters"),
+    ("encounter_reaction_time", "<f8", "n_encounters"),
+    ("encounter_reaction_time_is_int", "u1", "n_encounters"),
+    ("encounter_decay", "<f8", "n_encounters")
+)
+
+
+def dumps(model):
+    # type: (SpacingModel) -> bytes
+    """
+    Serialise the complete state of a model (facts, responses, per-fact encounters, rates of forgetting and decays) to a binary snapshot.
+    """
+    # Facts that were added to the model come first, followed by facts that only occur in responses
+    facts = []
+    fact_index = {}
+    for fact in list(model.facts) + [r.fact for r in model.responses]:
+        if fact.fact_id not in fact_index:
+            fact_index[fact.fact_id] = len(facts)
+            facts.append(fact)
+
+    states = [model._fact_states.get(fact.fact_id) for fact in facts]
+    encounters = [e for state in states if state is not None for e in state.encounters]
+
+    columns = {}
+    columns["response_fact"] = [fact_index[r.fact.fact_id] for r in model.responses]
+    columns["response_start_time"], columns["response_start_time_is_int"] = _encode_numbers([r.start_time for r in model.responses])
+    columns["response_rt"], columns["response_rt_is_int"] = _encode_numbers([r.rt for r in model.responses])
+    columns["response_correct"] = [bool(r.correct) for r in model.responses]
+    columns["response_alpha"] = model._alphas
+    columns["state_present"] = [state is not None for state in states]
+    states = [state if state is not None else FactState(0, 0, model.DEFAULT_ALPHA) for state in states]
+    columns["state_alpha"] = [state.alpha for state in states]
+    columns["state_reading_time"], columns["state_reading_time_is_int"] = _encode_numbers([state.reading_time for state in states])
+    columns["state_max_rt"] = [state.max_rt for state in states]
+    columns["state_last_time"] = [state.last_time for state in states]
+    columns["state_in_order"] = [state.in_order for state in states]
+    columns["state_count"] = [len(state.encounters) for state in states]
+    columns["encounter_activation"] = [e.activation for e in encounters]
+    columns["encounter_time"], columns["encounter_time_is_int"] = _encode_numbers([e.time for e in encounters])
+    columns["encounter_reaction_time"], columns["encounter_reaction_time_is_int"] = _encode_numbers([e.reaction_time for e in encounters])
+    columns["encounter_decay"] = [e.decay for e in encounters]
+
+    header = {
+        "scheduler": "threshold" if model._scheduler is not None else "scan",
+        "constants": dict((name, getattr(model, name)) for name in CONSTANTS),
+        "facts": [list(fact) for fact in facts],
+        "n_added_facts": len(model.facts),
+        "n_facts": len(facts),
+        "n_responses": len(model.responses),
+        "n_encounters": len(encounters)
+    }
+    header_bytes = json.dumps(header, ensure_ascii = False).encode("UTF-8")
+
+    data = io.BytesIO()
+    data.write(MAGIC)
+    data.write(struct.pack("<II", VERSION, len(header_bytes)))
+    data.write(header_bytes)
+    for (name, dtype, _) in COLUMNS:
+        data.write(np.asarray(columns[name], dtype = dtype).tobytes())
+
+    return(data.getvalue())
+
+
+def loads(data):
+    # type: (bytes) -> SpacingModel
+    """
+    Restore a model from a binary snapshot, without replaying its responses.
+    No activations or rates of forgetting are recalculated, but the Response tuples, encounters and start time index are rebuilt, so restoring takes time linear in the number of responses and encounters.
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        raise RuntimeError("Error while loading snapshot: The data is not a spacing model snapshot")
+
+    version, header_size = struct.unpack_from("<II", data, len(MAGIC))
+    if version != VERSION:
+        raise RuntimeError("Error while loading snapshot: Unsupported snapshot version: {}".format(version))
+
+    offset = len(MAGIC) + struct.calcsize("<II")
+    header = json.loads(data[offset:offset + header_size].decode("UTF-8"))
+    offset += header_size
+
+    columns = {}
+    for (name, dtype, count) in COLUMNS:
+        columns[name] = np.frombuffer(data, dtype = dtype, count = header[count], offset = offset)
+        offset += columns[name].nbytes
+
+    model = SpacingModel(scheduler = header["scheduler"])
+    for (name, value) in header["constants"].items():
+        if getattr(model, name) != value:
+            setattr(model, name, value)
+    if model._scheduler is not None:
+        model._scheduler.threshold = model.FORGET_THRESHOLD
+
+    facts = [Fact(*fact) for fact in header["facts"]]
+
+    # Per-fact state
+    activations = columns["encounter_activation"].tolist()
+    times = _decode_numbers(columns["encounter_time"], columns["encounter_time_is_int"])
+    reaction_times = _decode_numbers(columns["encounter_reaction_time"], columns["encounter_reaction_time_is_int"])
+    decays = columns["encounter_decay"].tolist()
+    reading_times = _decode_numbers(columns["state_reading_time"], columns["state_reading_time_is_int"])
+    start = 0
+    for (i, fact) in enumerate(facts):
+        end = start + int(columns["state_count"][i])
+        if columns["state_present"][i]:
+            state = FactState(reading_times[i], float(columns["state_max_rt"][i]), float(columns["state_alpha"][i]))
+            state.encounters = [Encounter(*e) for e in zip(activations[start:end], times[start:end], reaction_times[start:end], decays[start:end])]
+            state.last_time = float(columns["state_last_time"][i])
+            state.in_order = bool(columns["state_in_order"][i])
+            model._fact_states[fact.fact_id] = state
+        start = end
+
+    # Facts that were added to the model, in order
+    for fact in facts[:header["n_added_facts"]]:
+        model.facts.append(fact)
+        model._facts_by_id[fact.fact_id] = fact
+        row = model._engine.add_row(fact.fact_id)
+        if model._scheduler is not None:
+            model._scheduler.add_row(row)
+        model._update_engine(fact.fact_id, model._fact_states[fact.fact_id])
+
+    # Responses and their indexes
+    start_times = _decode_numbers(columns["response_start_time"], columns["response_start_time_is_int"])
+    rts = _decode_numbers(columns["response_rt"], columns["response_rt_is_int"])
+    for (i, (fact, start_time, rt, correct)) in enumerate(zip(columns["response_fact"].tolist(), start_times, rts, columns["response_correct"].tolist())):
+        response = Response(facts[fact], start_time, rt, bool(correct))
+        model.responses.append(response)
+        model._start_times.add(start_time)
+        model._response_indices.setdefault(response.fact.fact_id, []).append(i)
+
+    model._alphas = columns["response_alpha"].tolist()
+    return(model)
+
+
+def save_snapshot(model, path):
+    # type: (SpacingModel, str) -> None
+    """
+    Save a snapshot of the model to the specified file.
+    """
+    with io.open(path, "wb") as f:
+        f.write(dumps(model))
+
+
+def load_snapshot(path):
+    # type: (str) -> SpacingModel
+    """
+    Restore a model from the snapshot in the specified file.
+    """
+    with io.open(path, "rb") as f:
+        return(loads(f.read()))
+
+
+def _encode_numbers(values):
+    # type: ([float]) -> ([float], [bool])
+    """
+    Split numbers into their values and whether they are integers, so that they can be restored with their original type.
+    """
+    return((values, [isinstance(v, (int, np.integer)) and not isinstance(v, bool) for v in values]))
+
+
+def _decode_numbers(values, is_int):
+    # type: (np.ndarray, np.ndarray) -> [float]
+    return([int(v) if i else v for (v, i) in zip(values.tolist(), is_int.tolist())])
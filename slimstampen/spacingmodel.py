@@ -1,12 +1,32 @@
 from __future__ import division
 import math
+import numpy as np
 import pandas as pd
 from collections import namedtuple
 
+from .activation import ActivationEngine, calculate_reaction_time_errors
+from .datawriter import DataWriter
+from .scheduler import ThresholdScheduler
+
 Fact = namedtuple("Fact", "fact_id, question, answer")
 Response = namedtuple("Response", "fact, start_time, rt, correct")
 Encounter = namedtuple("Encounter", "activation, time, reaction_time, decay")
 
+class FactState(object):
+    """
+    Model state of a single fact, updated incrementally as responses are registered.
+    """
+    __slots__ = ("encounters", "alpha", "reading_time", "max_rt", "last_time", "in_order")
+
+    def __init__(self, reading_time, max_rt, alpha):
+        self.encounters = []
+        self.alpha = alpha
+        self.reading_time = reading_time
+        self.max_rt = max_rt
+        self.last_time = -float("inf")
+        self.in_order = True
+
+
 class SpacingModel(object):
 
     # Model constants
@@ -16,9 +36,37 @@ class SpacingModel(object):
     C = 0.25
     F = 1.0
 
-    def __init__(self):
+    # Available strategies for choosing the next fact
+    SCHEDULERS = ("scan", "threshold")
+
+    def __init__(self, scheduler = "scan", responses = None):
+        # type: (str, [Response]) -> None
+        """
+        Create a model that uses the specified scheduler to choose the next fact.
+        The "scan" scheduler scores all facts on every trial, the "threshold" scheduler keeps track of when each fact is expected to drop below the forgetting threshold.
+        Responses are stored in a list, unless another container with the same interface is specified (e.g. a ResponseLog); any responses it already contains are registered.
+        """
+        if scheduler not in self.SCHEDULERS:
+            raise RuntimeError(
+                "Error while creating model: Unknown scheduler: {}. The scheduler must be one of {}".format(scheduler, ", ".join(self.SCHEDULERS)))
+
         self.facts = []
         self.responses = []
+        self._alphas = []
+        self._writer = None
+        self._facts_by_id = {}
+        self._start_times = set()
+        self._response_indices = {}
+        self._fact_states = {}
+        self._engine = ActivationEngine()
+        self._scheduler = ThresholdScheduler(self._engine, self.FORGET_THRESHOLD) if scheduler == "threshold" else None
+
+        if responses is not None:
+            for (i, response) in enumerate(responses):
+                self._check_response(response)
+                self._track_response(response, i)
+            self.responses = responses
+
 
     def add_fact(self, fact):
         # type: (Fact) -> None
@@ -26,11 +74,19 @@ class SpacingModel(object):
         Add a fact to the list of study items.
         """
         # Ensure that a fact with this ID does not exist already
-        if next((f for f in self.facts if f.fact_id == fact.fact_id), None):
+        if fact.fact_id in self._facts_by_id:
             raise RuntimeError(
                 "Error while adding fact: There is already a fact with the same ID: {}. Each fact must have a unique ID".format(fact.fact_id))
 
         self.facts.append(fact)
+        self._facts_by_id[fact.fact_id] = fact
+        state = self._get_fact_state(fact)
+
+        # Facts are scored in the order in which they were added
+        row = self._engine.add_row(fact.fact_id)
+        if self._scheduler is not None:
+            self._scheduler.add_row(row)
+        self._update_engine(fact.fact_id, state)
 
 
     def register_response(self, response):
@@ -38,12 +94,48 @@ class SpacingModel(object):
         """
         Register a response.
         """
-        # Prevent duplicate responses
-        if next((r for r in self.responses if r.start_time == response.start_time), None):
-            raise RuntimeError(
-                "Error while registering response: A response has already been logged at this start_time: {}. Each response must occur at a unique start_time.".format(response.start_time))
-
+        self._check_response(response)
         self.responses.append(response)
+        self._track_response(response, len(self.responses) - 1)
+
+        if self._writer is not None:
+            self._writer.write_response(len(self.responses), response, self._alphas[-1])
+
+
+    def add_facts(self, facts):
+        # type: ([Fact]) -> None
+        """
+        Add multiple facts to the list of study items.
+        None of the facts are added if any of their IDs is already in use.
+        """
+        facts = list(facts)
+        fact_ids = set()
+        for fact in facts:
+            if fact.fact_id in self._facts_by_id or fact.fact_id in fact_ids:
+                raise RuntimeError(
+                    "Error while adding facts: There is already a fact with the same ID: {}. Each fact must have a unique ID".format(fact.fact_id))
+            fact_ids.add(fact.fact_id)
+
+        for fact in facts:
+            self.add_fact(fact)
+
+
+    def register_responses(self, responses):
+        # type: ([Response]) -> None
+        """
+        Register multiple responses, in order.
+        None of the responses are registered if any of their start_times is already in use.
+        """
+        responses = list(responses)
+        start_times = set()
+        for response in responses:
+            if response.start_time in self._start_times or response.start_time in start_times:
+                raise RuntimeError(
+                    "Error while registering responses: A response has already been logged at this start_time: {}. Each response must occur at a unique start_time.".format(response.start_time))
+            start_times.add(response.start_time)
+
+        for response in responses:
+            self.register_response(response)
 
 
     def get_next_fact(self, current_time):
@@ -52,25 +144,35 @@ class SpacingModel(object):
         Returns a tuple containing the fact that needs to be repeated most urgently and a boolean indicating whether this fact is new (True) or has been presented before (False).
         If none of the previously studied facts needs to be repeated right now, return a new fact instead.
         """
+        lookahead_time = current_time + self.LOOKAHEAD_TIME
+
+        if self._scheduler is not None:
+            last_row = self._engine.rows.get(self.responses[-1].fact.fact_id, -1) if self.responses else -1
+            choice = self._scheduler.select(lookahead_time, last_row)
+            if choice is not None:
+                return((self.facts[choice[0]], choice[1]))
+
         # Calculate all fact activations in the near future
-        fact_activations = [(f, self.calculate_activation(current_time + self.LOOKAHEAD_TIME, f)) for f in self.facts]
+        activations = self._engine.calculate_activations(lookahead_time)
+        for i in self._engine.stale_rows(lookahead_time):
+            activations[i] = self.calculate_activation(lookahead_time, self.facts[i])
 
-        seen_facts = [(f, a) for (f, a) in fact_activations if a > -float("inf")]
-        not_seen_facts = [(f, a) for (f, a) in fact_activations if a == -float("inf")]
+        seen_facts = np.flatnonzero(activations > -np.inf)
+        not_seen_facts = np.flatnonzero(activations == -np.inf)
 
         # Prevent an immediate repetition of the same fact
         if len(seen_facts) > 2:
             last_response = self.responses[-1]
-            seen_facts = [(f, a) for (f, a) in seen_facts if f.fact_id != last_response.fact.fact_id]
+            seen_facts = seen_facts[seen_facts != self._engine.rows.get(last_response.fact.fact_id, -1)]
 
         # Reinforce the weakest fact with an activation below the threshold
-        seen_facts_below_threshold = [(f, a) for (f, a) in seen_facts if a < self.FORGET_THRESHOLD]
-        if len(not_seen_facts) == 0 or len(seen_facts_below_threshold) > 0:
-            weakest_fact = min(seen_facts, key = lambda t: t[1])
-            return((weakest_fact[0], False))
+        seen_activations = activations[seen_facts]
+        if len(not_seen_facts) == 0 or np.any(seen_activations < self.FORGET_THRESHOLD):
+            weakest_fact = seen_facts[np.argmin(seen_activations)]
+            return((self.facts[weakest_fact], False))
 
         # If none of the previously seen facts has an activation below the threshold, return a new fact
-        return((not_seen_facts[0][0], True))
+        return((self.facts[not_seen_facts[0]], True))
 
 
     def get_rate_of_forgetting(self, time, fact):
@@ -78,20 +180,15 @@ class SpacingModel(object):
         """
         Return the estimated rate of forgetting of the fact at the specified time
         """
-        encounters = []
-
-        responses_for_fact = [r for r in self.responses if r.fact.fact_id == fact.fact_id and r.start_time < time]
-        alpha = self.DEFAULT_ALPHA
-
-        # Calculate the activation by running through the sequence of previous responses
-        for response in responses_for_fact:
-            activation = self.calculate_activation_from_encounters(encounters, response.start_time)
-            encounters.append(Encounter(activation, response.start_time, self.normalise_reaction_time(response), self.DEFAULT_ALPHA))
-            alpha = self.estimate_alpha(encounters, activation, response, alpha)
+        state = self._fact_states.get(fact.fact_id)
+        if state is None or not state.encounters:
+            return(self.DEFAULT_ALPHA)
 
-            # Update decay estimates of previous encounters
-            encounters = [encounter._replace(decay = self.calculate_decay(encounter.activation, alpha)) for encounter in encounters]
+        # The cached state can be used as-is if all of the fact's responses happened before the specified time
+        if state.last_time < time:
+            return(state.alpha)
 
+        encounters, alpha = self._replay_responses(time, fact)
         return(alpha)
 
 
@@ -101,21 +198,110 @@ class SpacingModel(object):
         Calculate the activation of a fact at the given time.
         """
 
+        state = self._fact_states.get(fact.fact_id)
+        if state is None or not state.encounters:
+            return(-float("inf"))
+
+        # The cached state can be used as-is if all of the fact's responses happened before the specified time
+        if state.last_time < time:
+            return(self.calculate_activation_from_encounters(state.encounters, time))
+
+        encounters, alpha = self._replay_responses(time, fact)
+        return(self.calculate_activation_from_encounters(encounters, time))
+
+
+    def _check_response(self, response):
+        # type: (Response) -> None
+        """
+        Ensure that a response can be registered.
+        """
+        # Prevent duplicate responses
+        if response.start_time in self._start_times:
+            raise RuntimeError(
+                "Error while registering response: A response has already been logged at this start_time: {}. Each response must occur at a unique start_time.".format(response.start_time))
+
+
+    def _track_response(self, response, index):
+        # type: (Response, int) -> None
+        """
+        Update the indexes and fact state with a response that has been added to the list of responses at the given index.
+        """
+        self._start_times.add(response.start_time)
+        self._response_indices.setdefault(response.fact.fact_id, []).append(index)
+
+        # Advance the fact's state by a single encounter instead of replaying its history later on
+        state = self._get_fact_state(response.fact)
+        state.encounters, state.alpha = self._add_encounter(state.encounters, state.alpha, response, state)
+
+        # A response that precedes (or falls within a millisecond of) an earlier one changes the history behind the alphas recorded so far
+        if response.start_time < state.last_time + 1:
+            state.in_order = False
+        state.last_time = max(state.last_time, response.start_time)
+        if response.fact.fact_id in self._engine.rows:
+            self._update_engine(response.fact.fact_id, state)
+
+        # Record the rate of forgetting estimate after this observation
+        self._alphas.append(state.alpha)
+
+
+    def _get_fact_state(self, fact):
+        # type: (Fact) -> FactState
+        """
+        Return the state of a fact, creating it if the fact has not been encountered before.
+        """
+        state = self._fact_states.get(fact.fact_id)
+        if state is None:
+            reading_time = self.get_reading_time(fact.question)
+            max_rt = 1.5 * self.estimate_reaction_time_from_activation(self.FORGET_THRESHOLD, reading_time)
+            state = FactState(reading_time, max_rt, self.DEFAULT_ALPHA)
+            self._fact_states[fact.fact_id] = state
+
+        return(state)
+
+
+    def _update_engine(self, fact_id, state):
+        # type: (int, FactState) -> None
+        """
+        Copy the encounter times and decays of a fact to the activation engine.
+        """
+        self._engine.set_encounters(fact_id, [e.time for e in state.encounters], [e.decay for e in state.encounters])
+        if self._scheduler is not None:
+            self._scheduler.update_row(self._engine.rows[fact_id])
+
+
+    def _add_encounter(self, encounters, alpha, response, state):
+        # type: ([Encounter], float, Response, FactState) -> ([Encounter], float)
+        """
+        Add the encounter resulting from a response to a fact's sequence of encounters, and return the updated encounters and rate of forgetting.
+        """
+        activation = self.calculate_activation_from_encounters(encounters, response.start_time)
+        rt = response.rt if response.correct else 60000
+        encounters = encounters + [Encounter(activation, response.start_time, min(rt, state.max_rt), self.DEFAULT_ALPHA)]
+        alpha = self.estimate_alpha(encounters, activation, response, alpha, state.reading_time)
+
+        # Update decay estimates of previous encounters
+        encounters = [encounter._replace(decay = self.calculate_decay(encounter.activation, alpha)) for encounter in encounters]
+
+        return((encounters, alpha))
+
+
+    def _replay_responses(self, time, fact):
+        # type: (int, Fact) -> ([Encounter], float)
+        """
+        Rebuild the encounters and rate of forgetting of a fact from the responses that occurred before the specified time.
+        """
         encounters = []
 
-        responses_for_fact = [r for r in self.responses if r.fact.fact_id == fact.fact_id and r.start_time < time]
+        responses_for_fact = [self.responses[i] for i in self._response_indices.get(fact.fact_id, [])]
+        responses_for_fact = [r for r in responses_for_fact if r.start_time < time]
         alpha = self.DEFAULT_ALPHA
+        state = self._get_fact_state(fact)
 
         # Calculate the activation by running through the sequence of previous responses
         for response in responses_for_fact:
-            activation = self.calculate_activation_from_encounters(encounters, response.start_time)
-            encounters.append(Encounter(activation, response.start_time, self.normalise_reaction_time(response), self.DEFAULT_ALPHA))
-            alpha = self.estimate_alpha(encounters, activation, response, alpha)
-
-            # Update decay estimates of previous encounters
-            encounters = [encounter._replace(decay = self.calculate_decay(encounter.activation, alpha)) for encounter in encounters]
+            encounters, alpha = self._add_encounter(encounters, alpha, response, state)
 
-        return(self.calculate_activation_from_encounters(encounters, time))
+        return((encounters, alpha))
 
 
     def calculate_decay(self, activation, alpha):
@@ -126,8 +312,8 @@ class SpacingModel(object):
         return self.C * math.exp(activation) + alpha
 
 
-    def estimate_alpha(self, encounters, activation, response, previous_alpha):
-        # type: ([Encounter], float, Response, float) -> float
+    def estimate_alpha(self, encounters, activation, response, previous_alpha, reading_time = None):
+        # type: ([Encounter], float, Response, float, float) -> float
         """
         Estimate the rate of forgetting parameter (alpha) for an item.
         """
@@ -135,7 +321,8 @@ class SpacingModel(object):
             return(self.DEFAULT_ALPHA)
 
         a_fit = previous_alpha
-        reading_time = self.get_reading_time(response.fact.question)
+        if reading_time is None:
+            reading_time = self.get_reading_time(response.fact.question)
         estimated_rt = self.estimate_reaction_time_from_activation(activation, reading_time)
         est_diff = estimated_rt - self.normalise_reaction_time(response)
 
@@ -149,26 +336,33 @@ class SpacingModel(object):
             a0 = a_fit - 0.05
             a1 = a_fit
 
-        # Binary search between previous fit and proposed alpha
-        for _ in range(6):
-            # Adjust all decays to use the new alpha
-            a0_diff = a0 - a_fit
-            a1_diff = a1 - a_fit
-            d_a0 = [e._replace(decay = e.decay + a0_diff) for e in encounters]
-            d_a1 = [e._replace(decay = e.decay + a1_diff) for e in encounters]
-
-            # Calculate the reaction times from activation and compare against observed RTs
-            encounter_window = encounters[max(1, len(encounters) - 5):]
-            total_a0_error = self.calculate_predicted_reaction_time_error(encounter_window, d_a0, reading_time)
-            total_a1_error = self.calculate_predicted_reaction_time_error(encounter_window, d_a1, reading_time)
+        # Every bracket the binary search can end up in has its bounds on a grid of 2^6 intervals, so the errors of all candidate alphas can be calculated in one go
+        n_steps = 6
+        candidates = a0 + (a1 - a0) * np.arange(2 ** n_steps + 1) / 2 ** n_steps
+        encounter_window = encounters[max(1, len(encounters) - 5):]
+        errors = calculate_reaction_time_errors(
+            [e.time for e in encounters],
+            [e.decay for e in encounters],
+            [e.time - 100 for e in encounter_window],
+            [e.reaction_time for e in encounter_window],
+            candidates - a_fit,
+            reading_time,
+            self.F)
 
+        # Binary search between previous fit and proposed alpha
+        i0 = 0
+        i1 = 2 ** n_steps
+        for _ in range(n_steps):
             # Adjust the search area based on the lowest total error
             ac = (a0 + a1) / 2
-            if total_a0_error < total_a1_error:
+            ic = (i0 + i1) // 2
+            if errors[i0] < errors[i1]:
                 a1 = ac
+                i1 = ic
             else:
                 a0 = ac
-        
+                i0 = ic
+
         # The new alpha estimate is the average value in the remaining bracket
         return((a0 + a1) / 2)
 
@@ -243,16 +437,19 @@ class SpacingModel(object):
         If no path is specified, return a CSV-formatted copy of the data instead.
         """
 
-        def calc_rof(row):
-            return(self.get_rate_of_forgetting(row["start_time"] + 1, row["fact"]))
-
-        dat_resp = pd.DataFrame(self.responses)
-        dat_facts = pd.DataFrame([r.fact for r in self.responses])
-        dat = pd.concat([dat_resp, dat_facts], axis = 1)
+        # Use the rate of forgetting estimate recorded after each observation, unless the fact's responses were registered out of order
+        alphas = [alpha if self._fact_states[r.fact.fact_id].in_order else self.get_rate_of_forgetting(r.start_time + 1, r.fact)
+                  for (r, alpha) in zip(self.responses, self._alphas)]
 
-        # Add column for rate of forgetting estimate after each observation
-        dat["alpha"] = dat.apply(calc_rof, axis = 1)
-        dat.drop(columns = "fact", inplace = True)
+        dat = pd.DataFrame({
+            "start_time": [r.start_time for r in self.responses],
+            "rt": [r.rt for r in self.responses],
+            "correct": [r.correct for r in self.responses],
+            "fact_id": [r.fact.fact_id for r in self.responses],
+            "question": [r.fact.question for r in self.responses],
+            "answer": [r.fact.answer for r in self.responses],
+            "alpha": alphas
+        })
 
         # Add trial number column
         dat.index.name = "trial"
@@ -264,3 +461,24 @@ class SpacingModel(object):
             return(dat)
         
         return(dat.to_csv())
+
+
+    def stream_data(self, path):
+        # type: (str) -> DataWriter
+        """
+        Append the data of every response registered from now on to the specified csv file, in the same format as export_data.
+        Each row contains the rate of forgetting estimate at the time the response was registered.
+        """
+        self.close_stream()
+        self._writer = DataWriter(path)
+        return(self._writer)
+
+
+    def close_stream(self):
+        # type: () -> None
+        """
+        Stop streaming response data and close the csv file.
+        """
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
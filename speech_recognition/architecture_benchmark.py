@@ -0,0 +1,127 @@
+import os
+import csv
+import time
+import argparse
+import multiprocessing
+import numpy as np
+from export_tflite import peak_memory_mb
+
+# Benchmark a family of doubt CNN architectures on the CPU: every variant is trained on the same cached dataset and split,
+# and its validation accuracy is reported next to single-clip latency, batch throughput, parameter count and memory use,
+# so that a model can be picked for a fixed per-trial latency budget.
+# Each variant runs in its own process (one at a time, with a fixed number of threads), so memory and timings are not shared.
+#
+# Usage:
+#     python speech_recognition/architecture_benchmark.py --epochs 20 --threads 2 --budget-ms 20 --output architectures.csv
+
+# Keyword arguments for create_cnn_model
+VARIANTS = {
+    'baseline': {},
+    'narrow': {'filters': (16, 32, 64)},
+    'wide': {'filters': (64, 128, 256)},
+    'two_blocks': {'filters': (32, 64)},
+    'separable': {'separable': True},
+    'separable_narrow': {'filters': (16, 32, 64), 'separable': True},
+    'small_head': {'dense_units': 32},
+    'global_pooling': {'global_pooling': True},
+    'separable_pooling': {'separable': True, 'global_pooling': True, 'dense_units': 32},
+}
+
+
+def percentile_ms(durations, q):
+    return float(np.percentile(durations, q) * 1000)
+
+
+def run_variant(task):
+    name, variant, options = task
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(options['threads'])
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    from doubt_detectionCNN import prepare_dataset, split_file_indexes, create_cnn_model
+
+    # Features come from the shared cache, which the parent process has filled
+    X, y = prepare_dataset(options['confident_dir'], options['doubtful_dir'])
+    train_idx, val_idx = split_file_indexes(len(y))
+
+    memory_before = peak_memory_mb()
+    tf.random.set_seed(42)
+    model = create_cnn_model(X.shape[1:], **variant)
+    start = time.perf_counter()
+    model.fit(X[train_idx], y[train_idx], epochs=options['epochs'], batch_size=32, verbose=0)
+    train_time = time.perf_counter() - start
+    accuracy = float(np.mean(np.argmax(model.predict(X[val_idx], verbose=0), axis=1) == y[val_idx]))
+
+    # Single-clip latency, as seen by the flashcard app after each answer
+    clip = X[:1]
+    for _ in range(10):
+        model.predict_on_batch(clip)
+    durations = []
+    for _ in range(options['runs']):
+        start = time.perf_counter()
+        model.predict_on_batch(clip)
+        durations.append(time.perf_counter() - start)
+
+    # Batch throughput
+    batch = np.resize(X, (options['batch_size'],) + X.shape[1:])
+    model.predict_on_batch(batch)
+    start = time.perf_counter()
+    n_batches = max(1, options['runs'] // 10)
+    for _ in range(n_batches):
+        model.predict_on_batch(batch)
+    throughput = n_batches * options['batch_size'] / (time.perf_counter() - start)
+
+    return {
+        'variant': name,
+        'val_accuracy': accuracy,
+        'p50_ms': percentile_ms(durations, 50),
+        'p99_ms': percentile_ms(durations, 99),
+        'clips_per_sec': throughput,
+        'parameters': model.count_params(),
+        'weights_mb': sum(w.nbytes for w in model.get_weights()) / (1024 * 1024),
+        'peak_memory_mb': peak_memory_mb(),
+        'model_memory_mb': peak_memory_mb() - memory_before,  # Growth of the peak while building, training and running the model
+        'train_time_s': train_time
+    }
+
+
+if __name__ == "__main__":
+    os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
+    parser = argparse.ArgumentParser(description="Benchmark doubt CNN architecture variants on the CPU")
+    parser.add_argument("--confident-dir", default='speech_recognition/Data/confident/')
+    parser.add_argument("--doubtful-dir", default='speech_recognition/Data/doubtful/')
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=list(VARIANTS))
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=1, help="CPU threads per model, to match the deployment machines")
+    parser.add_argument("--runs", type=int, default=200, help="number of timed single-clip inferences")
+    parser.add_argument("--batch-size", type=int, default=32, help="batch size for the throughput measurement")
+    parser.add_argument("--budget-ms", type=float, default=None, help="per-trial latency budget (p99) to select a model for")
+    parser.add_argument("--output", default="architectures.csv")
+    args = parser.parse_args()
+
+    # Fill the feature cache once, so that every variant trains on identical features without decoding audio
+    from doubt_detectionCNN import prepare_dataset
+    prepare_dataset(args.confident_dir, args.doubtful_dir, n_workers=os.cpu_count())
+
+    options = {'confident_dir': args.confident_dir, 'doubtful_dir': args.doubtful_dir, 'epochs': args.epochs,
+               'threads': args.threads, 'runs': args.runs, 'batch_size': args.batch_size}
+    results = []
+    with multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+        for result in pool.imap(run_variant, [(name, VARIANTS[name], options) for name in args.variants]):
+            results.append(result)
+            print(f"{result['variant']:<20} acc {result['val_accuracy']:.3f}  p50 {result['p50_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms  "
+                  f"{result['clips_per_sec']:8.1f} clips/s  {result['parameters']:>9} params  {result['weights_mb']:6.2f} MB weights  "
+                  f"{result['model_memory_mb']:6.0f} MB for the model ({result['peak_memory_mb']:.0f} MB peak)")
+
+    with open(args.output, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+    print(f"Results saved at: {args.output}")
+
+    if args.budget_ms is not None:
+        within_budget = [r for r in results if r['p99_ms'] <= args.budget_ms]
+        if within_budget:
+            best = max(within_budget, key=lambda r: r['val_accuracy'])
+            print(f"Most accurate variant within {args.budget_ms} ms (p99): {best['variant']} (accuracy {best['val_accuracy']:.3f}, p99 {best['p99_ms']:.2f} ms)")
+        else:
+            print(f"No variant meets the {args.budget_ms} ms budget")
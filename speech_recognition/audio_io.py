@@ -0,0 +1,89 @@
+import os
+import struct
+import numpy as np
+
+# Shared audio loader for the feature functions.
+# PCM (8/16/32-bit integer) and 32-bit float WAV files are memory-mapped and converted to float32 straight from the mapped samples,
+# with the same scaling as librosa.load (e.g. int16 / 32768). Audio is only resampled when sr is given and differs from the file's rate.
+# Any other format (24-bit or compressed WAV, mp3, ...) falls back to librosa.load.
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+SAMPLE_TYPES = {
+    (WAVE_FORMAT_PCM, 1): (np.uint8, 128, 1 / 128),
+    (WAVE_FORMAT_PCM, 2): (np.dtype('<i2'), 0, 1 / 32768),
+    (WAVE_FORMAT_PCM, 4): (np.dtype('<i4'), 0, 1 / 2147483648),
+    (WAVE_FORMAT_IEEE_FLOAT, 4): (np.dtype('<f4'), 0, 1.0),
+}
+
+
+# Load an audio file as float32 samples, with the same arguments and defaults as librosa.load; returns (y, sr)
+def load_audio(path, sr=22050, mono=True):
+    wav = read_wav_header(path) if str(path).lower().endswith('.wav') else None
+    if wav is None or (wav['format'], wav['sample_width']) not in SAMPLE_TYPES:
+        import librosa
+        return librosa.load(path, sr=sr, mono=mono)
+
+    dtype, offset, scale = SAMPLE_TYPES[(wav['format'], wav['sample_width'])]
+    n_frames = wav['data_size'] // (wav['sample_width'] * wav['channels'])
+    if n_frames == 0:
+        y = np.zeros((0,) if mono or wav['channels'] == 1 else (wav['channels'], 0), dtype=np.float32)
+    else:
+        samples = np.memmap(path, dtype=dtype, mode='r', offset=wav['data_offset'], shape=(n_frames, wav['channels']))
+        if wav['channels'] == 1:
+            y = convert_samples(samples[:, 0], offset, scale)
+        elif mono:
+            y = convert_samples(samples, offset, scale).mean(axis=1, dtype=np.float32)
+        else:
+            y = np.ascontiguousarray(convert_samples(samples, offset, scale).T)
+        del samples
+
+    if sr is not None and sr != wav['sample_rate']:
+        import librosa
+        return librosa.resample(y, orig_sr=wav['sample_rate'], target_sr=sr), sr
+    return y, wav['sample_rate']
+
+
+# Convert mapped integer or float samples to float32 in a single pass
+def convert_samples(samples, offset, scale):
+    y = np.empty(samples.shape, dtype=np.float32)
+    if offset:
+        np.subtract(samples, offset, out=y, dtype=np.float32)
+    else:
+        np.copyto(y, samples, casting='unsafe')
+    if scale != 1.0:
+        y *= np.float32(scale)
+    return y
+
+
+# Walk the RIFF chunks of a WAV file and return its format and the position of the sample data, or None if it is not a WAV file
+def read_wav_header(path):
+    with open(path, 'rb') as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+            return None
+
+        wav = {}
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk)
+            if chunk_id == b'fmt ':
+                fmt = f.read(chunk_size)
+                audio_format, channels, sample_rate, _, _, bits = struct.unpack('<HHIIHH', fmt[:16])
+                if audio_format == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+                    audio_format = struct.unpack('<H', fmt[24:26])[0]  # First two bytes of the sub-format GUID
+                wav.update(format=audio_format, channels=channels, sample_rate=sample_rate, sample_width=bits // 8)
+                if chunk_size % 2:
+                    f.seek(1, 1)
+            elif chunk_id == b'data':
+                if 'format' not in wav:
+                    return None
+                # Recorders that stream to disk may leave the data size unset, so it is limited to the end of the file
+                data_offset = f.tell()
+                wav.update(data_offset=data_offset, data_size=min(chunk_size, os.fstat(f.fileno()).st_size - data_offset))
+                return wav
+            else:
+                f.seek(chunk_size + chunk_size % 2, 1)  # Chunks are padded to an even size
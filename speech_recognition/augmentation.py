@@ -0,0 +1,126 @@
+import tensorflow as tf
+
+# On-the-fly augmentation of batches of log-mel spectrograms, for the training datasets of make_dataset and make_bucketed_dataset
+# (shape (batch, n_mels, frames, 1), in dB relative to the loudest bin of each clip, as stored in the feature cache).
+# Every clip in a batch gets its own random parameters, but the batch is transformed with a handful of vectorised TensorFlow ops,
+# so the augmentation runs as a parallel dataset.map on the tf.data threads and overlaps with training through prefetch.
+#
+# The cache holds spectrograms rather than waveforms, so all transformations work in the spectrogram domain:
+# - pitch: the frequency axis is stretched by a factor close to 1 (an approximation, as the mel scale is not linear in frequency)
+# - tempo and time shift: the time axis is resampled and shifted, with vacated frames filled with the quietest value of the clip
+# - gain and additive noise: applied to the mel power, with noise at a random signal-to-noise ratio. As the features are
+#   normalised to their loudest bin, the gain only changes the level of the recording relative to the noise.
+# - SpecAugment masking: random frequency bands and time spans are set to the quietest value of the clip
+# Clips padded to the length of the batch (by pad_spectrogram or bucket_by_sequence_length) end in frames of zeros, i.e. the loudest
+# value, while a real frame is 0 dB in at most a few bins. Only the frames before that padding are transformed and used for the
+# quietest value, the noise level and the normalisation; the padding is kept as it is, as the model sees it at inference.
+
+
+class SpectrogramAugmenter:
+    def __init__(self, max_pitch=0.05, max_tempo=0.1, max_shift=0.1, gain_db=6.0, noise_probability=0.5, snr_db=(10.0, 40.0),
+                 freq_masks=2, freq_mask_width=16, time_masks=2, time_mask_width=16, top_db=80.0):
+        self.max_pitch = max_pitch  # Largest relative change of pitch, e.g. 0.05 for +/- 5%
+        self.max_tempo = max_tempo  # Largest relative change of tempo
+        self.max_shift = max_shift  # Largest time shift, as a fraction of the frames
+        self.gain_db = gain_db
+        self.noise_probability = noise_probability
+        self.snr_db = snr_db
+        self.freq_masks = freq_masks
+        self.freq_mask_width = freq_mask_width
+        self.time_masks = time_masks
+        self.time_mask_width = time_mask_width
+        self.top_db = top_db
+
+    def __call__(self, spectrograms):
+        x = spectrograms[..., 0]
+        batch_size = tf.shape(x)[0]
+        n_mels = tf.shape(x)[1]
+        n_frames = tf.shape(x)[2]
+        lengths = valid_lengths(x)
+        valid = positions(n_frames)[:, tf.newaxis, :] < tf.cast(lengths, tf.float32)[:, :, tf.newaxis]  # (batch, 1, frames)
+
+        # Pitch: output bin i takes its value from bin i / factor
+        floor = reduce_min(x, valid)
+        pitch = 1.0 + tf.random.uniform((batch_size,), -self.max_pitch, self.max_pitch)
+        x = resample(x, positions(n_mels) / pitch[:, tf.newaxis], axis=1, fill=floor)
+
+        # Tempo and time shift: output frame t takes its value from frame t * factor - shift, within the real frames of the clip
+        tempo = 1.0 + tf.random.uniform((batch_size,), -self.max_tempo, self.max_tempo)
+        max_shift = self.max_shift * tf.cast(lengths[:, 0], tf.float32)
+        shift = tf.round(tf.random.uniform((batch_size,), -1.0, 1.0) * max_shift)
+        x = resample(x, positions(n_frames) * tempo[:, tf.newaxis] - shift[:, tf.newaxis], axis=2, fill=floor, length=lengths)
+
+        x = self.add_noise(x, valid, batch_size)
+
+        floor = reduce_min(x, valid)
+        mask = tf.logical_or(random_spans(tf.fill((batch_size, 1), n_mels), n_mels, self.freq_masks, self.freq_mask_width)[:, :, tf.newaxis],
+                             random_spans(lengths, n_frames, self.time_masks, self.time_mask_width)[:, tf.newaxis, :])
+        x = tf.where(mask, floor, x)
+        x = tf.where(valid, x, spectrograms[..., 0])  # Restore the padding
+        return x[..., tf.newaxis]
+
+    # Random gain and noise in the power domain, followed by the same normalisation as power_to_db(ref=np.max, top_db)
+    # The noise level is relative to the mean power of the real frames, which are also the only frames normalised
+    def add_noise(self, x, valid, batch_size):
+        power = tf.pow(10.0, x / 10.0)
+        gain_db = tf.random.uniform((batch_size, 1, 1), -self.gain_db, self.gain_db)
+        snr_db = tf.random.uniform((batch_size, 1, 1), self.snr_db[0], self.snr_db[1])
+        with_noise = tf.cast(tf.random.uniform((batch_size, 1, 1)) < self.noise_probability, tf.float32)
+        n_valid = tf.cast(tf.shape(x)[1], tf.float32) * tf.reduce_sum(tf.cast(valid, tf.float32), axis=2, keepdims=True)
+        mean_power = tf.reduce_sum(tf.where(valid, power, 0.0), axis=[1, 2], keepdims=True) / n_valid
+        noise_level = with_noise * mean_power * tf.pow(10.0, -snr_db / 10.0)
+        noise = noise_level * -tf.math.log(1.0 - tf.random.uniform(tf.shape(power)))  # Exponentially distributed, like the power of white noise
+
+        x = 10.0 * tf.math.log(tf.maximum(1e-10, tf.pow(10.0, gain_db / 10.0) * power + noise)) / tf.math.log(10.0)
+        x = x - tf.reduce_max(tf.where(valid, x, -float('inf')), axis=[1, 2], keepdims=True)
+        return tf.maximum(x, -self.top_db)
+
+
+def positions(length):
+    return tf.cast(tf.range(length), tf.float32)[tf.newaxis, :]
+
+
+# Number of frames (batch, 1) of each clip before its padding, i.e. up to and including the last frame that is not all zeros
+# (at least 1, so that a silent clip does not end up empty)
+def valid_lengths(x):
+    nonzero = tf.reduce_any(tf.not_equal(x, 0.0), axis=1)
+    ends = tf.where(nonzero, tf.range(1, tf.shape(x)[2] + 1)[tf.newaxis, :], 0)
+    return tf.maximum(tf.reduce_max(ends, axis=1, keepdims=True), 1)
+
+
+# Minimum (batch, 1, 1) of each clip over its real frames
+def reduce_min(x, valid):
+    return tf.reduce_min(tf.where(valid, x, float('inf')), axis=[1, 2], keepdims=True)
+
+
+# Linear interpolation of x (batch, n_mels, frames) along axis 1 or 2 at per-clip positions (batch, length); positions outside the input get fill
+# length (batch, 1) limits the input to the first length[i] positions of each clip, e.g. its frames before the padding
+def resample(x, source, axis, fill, length=None):
+    if length is None:
+        length = tf.shape(x)[axis]
+    lower = tf.floor(source)
+    weight = source - lower
+    lower = tf.cast(lower, tf.int32)
+    inside = tf.logical_and(lower >= 0, lower <= length - 1)
+    lower = tf.minimum(tf.maximum(lower, 0), length - 1)
+    upper = tf.minimum(lower + 1, length - 1)
+
+    values = (tf.gather(x, lower, axis=axis, batch_dims=1) * (1.0 - expand(weight, axis))
+              + tf.gather(x, upper, axis=axis, batch_dims=1) * expand(weight, axis))
+    return tf.where(expand(inside, axis), values, fill)
+
+
+# Add the axis that a (batch, length) tensor is broadcast over
+def expand(values, axis):
+    return values[:, :, tf.newaxis] if axis == 1 else values[:, tf.newaxis, :]
+
+
+# Boolean mask (batch, size) of n_spans random spans per clip, each up to max_width long and within the first lengths[i] (batch, 1) positions
+def random_spans(lengths, size, n_spans, max_width):
+    index = tf.range(size)[tf.newaxis, :]
+    mask = tf.zeros((tf.shape(lengths)[0], size), dtype=tf.bool)
+    for _ in range(n_spans):
+        width = tf.cast(tf.random.uniform(tf.shape(lengths)) * tf.cast(tf.minimum(max_width, lengths) + 1, tf.float32), tf.int32)
+        start = tf.cast(tf.random.uniform(tf.shape(lengths)) * tf.cast(lengths - width + 1, tf.float32), tf.int32)
+        mask = tf.logical_or(mask, tf.logical_and(index >= start, index < start + width))
+    return mask
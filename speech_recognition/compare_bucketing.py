@@ -0,0 +1,86 @@
+import os
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+
+from doubt_detectionCNN import (list_labelled_files, split_file_indexes, make_dataset, make_bucketed_dataset, create_cnn_model)
+
+# Compare length-bucketed training and inference (variable-width batches, global pooling) with the fixed 128-frame baseline
+# on the same train/validation split: validation accuracy, training and inference throughput, and the number of frames the CNN processes.
+#
+# Usage:
+#     python speech_recognition/compare_bucketing.py --epochs 20 --buckets 64 128 256
+
+
+# Records the duration of every training epoch
+class EpochTimer(tf.keras.callbacks.Callback):
+    def on_train_begin(self, logs=None):
+        self.durations = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.durations.append(time.perf_counter() - self.start)
+
+
+def run_variant(name, model, train_dataset, val_dataset, n_train, epochs):
+    # Iterate once before timing, so that features are cached and both variants start from the same state
+    frames = sum(int(x.shape[0] * x.shape[2]) for x, _ in train_dataset)  # Clips times (padded) width of every batch
+    for _ in val_dataset:
+        pass
+
+    timer = EpochTimer()
+    model.fit(train_dataset, epochs=epochs, callbacks=[timer], verbose=0)
+
+    start = time.perf_counter()
+    batches = [(model.predict_on_batch(x), y.numpy()) for x, y in val_dataset]
+    inference_time = time.perf_counter() - start
+    predictions = np.concatenate([np.argmax(p, axis=1) for p, _ in batches])
+    labels = np.concatenate([y for _, y in batches])
+
+    # The first epoch includes graph tracing for every new input shape, so it is left out of the throughput
+    epoch_time = np.mean(timer.durations[1:]) if len(timer.durations) > 1 else timer.durations[0]
+    return {
+        'variant': name,
+        'val_accuracy': float(np.mean(predictions == labels)),
+        'train_clips_per_sec': n_train / epoch_time,
+        'inference_clips_per_sec': len(labels) / inference_time,
+        'frames_per_epoch': frames,
+        'parameters': model.count_params()
+    }
+
+
+if __name__ == "__main__":
+    os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
+    parser = argparse.ArgumentParser(description="Compare bucketed variable-length batching with fixed-length padding")
+    parser.add_argument("--confident-dir", default='speech_recognition/Data/confident/')
+    parser.add_argument("--doubtful-dir", default='speech_recognition/Data/doubtful/')
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--buckets", type=int, nargs="+", default=[64, 128, 256], help="bucket boundaries in frames")
+    parser.add_argument("--max-len", type=int, default=512, help="frames after which bucketed clips are truncated")
+    args = parser.parse_args()
+
+    file_paths, labels = list_labelled_files(args.confident_dir, args.doubtful_dir)
+    labels = np.array(labels)
+    train_idx, val_idx = split_file_indexes(len(file_paths))
+    train_paths, val_paths = [file_paths[i] for i in train_idx], [file_paths[i] for i in val_idx]
+
+    results = []
+    tf.random.set_seed(42)
+    results.append(run_variant('fixed (128 frames)', create_cnn_model((128, 128, 1)),
+                               make_dataset(train_paths, labels[train_idx], batch_size=args.batch_size),
+                               make_dataset(val_paths, labels[val_idx], batch_size=args.batch_size, shuffle=False),
+                               len(train_idx), args.epochs))
+    tf.random.set_seed(42)
+    results.append(run_variant(f"bucketed {args.buckets}", create_cnn_model((128, None, 1), global_pooling=True),
+                               make_bucketed_dataset(train_paths, labels[train_idx], args.buckets, args.max_len, batch_size=args.batch_size),
+                               make_bucketed_dataset(val_paths, labels[val_idx], args.buckets, args.max_len, batch_size=args.batch_size, shuffle=False),
+                               len(train_idx), args.epochs))
+
+    print(f"{'variant':<28}{'val acc':>10}{'train clips/s':>16}{'infer clips/s':>16}{'frames/epoch':>15}{'params':>12}")
+    for r in results:
+        print(f"{r['variant']:<28}{r['val_accuracy']:>10.3f}{r['train_clips_per_sec']:>16.1f}{r['inference_clips_per_sec']:>16.1f}"
+              f"{r['frames_per_epoch']:>15}{r['parameters']:>12}")
@@ -0,0 +1,180 @@
+import os
+import json
+import argparse
+import tempfile
+import multiprocessing
+import numpy as np
+
+# Stratified k-fold cross-validation of the doubt classifiers (the CNN of doubt_detectionCNN.py and the SVM of doutbt_detection.py).
+# Features are extracted once (the spectrograms through the feature cache), saved to .npy files and memory-mapped by every worker,
+# so all folds read the same pages instead of each holding a copy. Folds are trained in parallel worker processes, each limited
+# to a fixed number of threads so that they do not compete for cores, and their confusion matrices are accumulated as they finish.
+# Both models are evaluated on the same folds, and the result is a single report with pooled and per-fold metrics.
+#
+# Usage:
+#     python speech_recognition/cross_validation.py --folds 5 --workers 4 --threads 1 --output cv_report.json
+
+CLASS_NAMES = ['Doubtful', 'Confident']
+THREAD_VARIABLES = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS']
+
+
+# Per-worker state, set by init_worker
+_worker = {}
+
+
+# Confusion matrices and metrics, updated one fold at a time
+class CrossValidationReport:
+    def __init__(self, name, n_classes=2):
+        self.name = name
+        self.confusion = np.zeros((n_classes, n_classes), dtype=np.int64)
+        self.folds = {}
+
+    def add_fold(self, fold, y_true, y_pred):
+        n_classes = len(self.confusion)
+        confusion = np.bincount(n_classes * np.asarray(y_true) + np.asarray(y_pred), minlength=n_classes ** 2).reshape(n_classes, n_classes)
+        self.confusion += confusion
+        self.folds[fold] = class_metrics(confusion)
+
+    # Metrics of the predictions of all folds together
+    def pooled(self):
+        return class_metrics(self.confusion)
+
+    def to_dict(self):
+        folds = [self.folds[fold] for fold in sorted(self.folds)]
+        return {
+            'model': self.name,
+            'confusion_matrix': self.confusion.tolist(),
+            'pooled': self.pooled(),
+            'accuracy_mean': float(np.mean([f['accuracy'] for f in folds])),
+            'accuracy_std': float(np.std([f['accuracy'] for f in folds])),
+            'f1_mean': np.mean([f['f1'] for f in folds], axis=0).tolist(),
+            'f1_std': np.std([f['f1'] for f in folds], axis=0).tolist(),
+            'folds': folds
+        }
+
+    def format(self):
+        result = self.to_dict()
+        pooled = result['pooled']
+        lines = [f"=== {self.name}: {len(self.folds)} folds ===",
+                 f"Accuracy: {result['accuracy_mean']:.3f} +/- {result['accuracy_std']:.3f} (pooled {pooled['accuracy']:.3f})",
+                 "Confusion Matrix (rows: true, columns: predicted):",
+                 str(self.confusion),
+                 f"{'':>12}{'precision':>11}{'recall':>9}{'f1-score':>10}{'f1 std':>8}{'support':>9}"]
+        for i, name in enumerate(CLASS_NAMES):
+            lines.append(f"{name:>12}{pooled['precision'][i]:>11.3f}{pooled['recall'][i]:>9.3f}{pooled['f1'][i]:>10.3f}"
+                         f"{result['f1_std'][i]:>8.3f}{pooled['support'][i]:>9}")
+        lines.append("Per fold accuracy: " + ", ".join(f"{f['accuracy']:.3f}" for f in result['folds']))
+        return "\n".join(lines)
+
+
+# Precision, recall and F1-score per class (0 where undefined, as in classification_report) from a confusion matrix
+def class_metrics(confusion):
+    true_positives = np.diag(confusion).astype(np.float64)
+    predicted = confusion.sum(axis=0)
+    support = confusion.sum(axis=1)
+    precision = np.divide(true_positives, predicted, out=np.zeros_like(true_positives), where=predicted > 0)
+    recall = np.divide(true_positives, support, out=np.zeros_like(true_positives), where=support > 0)
+    f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros_like(true_positives), where=precision + recall > 0)
+    return {
+        'accuracy': float(true_positives.sum() / max(1, confusion.sum())),
+        'precision': precision.tolist(),
+        'recall': recall.tolist(),
+        'f1': f1.tolist(),
+        'support': support.tolist()
+    }
+
+
+# Stratified folds as (fold, train indexes, test indexes), identical for every model
+def make_folds(labels, n_splits=5, seed=42):
+    from sklearn.model_selection import StratifiedKFold
+    splitter = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=seed)
+    return [(fold, train_idx, test_idx) for fold, (train_idx, test_idx) in enumerate(splitter.split(np.zeros(len(labels)), labels))]
+
+
+def init_worker(feature_paths, labels_path, threads, epochs):
+    # The thread variables are also set in the parent before the workers start; TensorFlow needs them set explicitly as well
+    if 'cnn' in feature_paths:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    _worker['features'] = {name: np.load(path, mmap_mode='r') for name, path in feature_paths.items()}
+    _worker['labels'] = np.load(labels_path)
+    _worker['epochs'] = epochs
+
+
+def run_fold(task):
+    model_name, fold, train_idx, test_idx = task
+    X = _worker['features'][model_name]
+    y = _worker['labels']
+
+    if model_name == 'cnn':
+        import tensorflow as tf
+        from doubt_detectionCNN import create_cnn_model
+        tf.keras.utils.set_random_seed(42 + fold)
+        model = create_cnn_model(X.shape[1:])
+        model.fit(X[train_idx], y[train_idx], epochs=_worker['epochs'], batch_size=32, verbose=0)
+        predictions = np.argmax(model.predict(X[test_idx], verbose=0), axis=1)
+        tf.keras.backend.clear_session()
+    else:
+        from doutbt_detection import create_svm_model
+        model = create_svm_model()
+        model.fit(X[train_idx], y[train_idx])
+        predictions = model.predict(X[test_idx])
+
+    return model_name, fold, y[test_idx], predictions
+
+
+if __name__ == "__main__":
+    os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
+    parser = argparse.ArgumentParser(description="Cross-validate the doubt classifiers")
+    parser.add_argument("--confident-dir", default='speech_recognition/Data/confident/')
+    parser.add_argument("--doubtful-dir", default='speech_recognition/Data/doubtful/')
+    parser.add_argument("--models", nargs="+", default=['cnn', 'svm'], choices=['cnn', 'svm'])
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--epochs", type=int, default=20, help="CNN training epochs per fold")
+    parser.add_argument("--threads", type=int, default=1, help="CPU threads per worker")
+    parser.add_argument("--workers", type=int, default=None, help="number of folds trained in parallel (default: cores / threads)")
+    parser.add_argument("--output", default=None, help="also write the report as JSON")
+    args = parser.parse_args()
+    n_workers = args.workers or max(1, (os.cpu_count() or 1) // args.threads)
+
+    # Extract the features once; the CNN spectrograms come from (and fill) the shared feature cache
+    features = {}
+    if 'cnn' in args.models:
+        from doubt_detectionCNN import prepare_dataset as prepare_cnn_dataset
+        features['cnn'], labels = prepare_cnn_dataset(args.confident_dir, args.doubtful_dir, n_workers=os.cpu_count())
+    if 'svm' in args.models:
+        from doutbt_detection import prepare_dataset as prepare_svm_dataset
+        features['svm'], labels = prepare_svm_dataset(args.confident_dir, args.doubtful_dir, n_workers=os.cpu_count())
+    folds = make_folds(labels, args.folds, args.seed)
+
+    for variable in THREAD_VARIABLES:
+        os.environ[variable] = str(args.threads if variable != 'TF_NUM_INTEROP_THREADS' else 1)
+
+    reports = {name: CrossValidationReport(name.upper()) for name in args.models}
+    with tempfile.TemporaryDirectory() as shared_dir:
+        feature_paths = {}
+        for name, X in features.items():
+            feature_paths[name] = os.path.join(shared_dir, f"{name}.npy")
+            np.save(feature_paths[name], X)
+        labels_path = os.path.join(shared_dir, 'labels.npy')
+        np.save(labels_path, labels)
+        del features
+
+        # The slow CNN folds are submitted first, so the SVM folds fill the gaps at the end
+        tasks = [(name, fold, train_idx, test_idx) for name in args.models for fold, train_idx, test_idx in folds]
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(n_workers, initializer=init_worker, initargs=(feature_paths, labels_path, args.threads, args.epochs)) as pool:
+            for name, fold, y_true, y_pred in pool.imap_unordered(run_fold, tasks):
+                reports[name].add_fold(fold, y_true, y_pred)
+                print(f"{name.upper()} fold {fold + 1}/{args.folds}: accuracy {reports[name].folds[fold]['accuracy']:.3f}")
+
+    print(f"\nStratified {args.folds}-fold cross-validation of {len(labels)} recordings ({np.sum(labels == 1)} confident, "
+          f"{np.sum(labels == 0)} doubtful), {n_workers} workers x {args.threads} threads\n")
+    print("\n\n".join(report.format() for report in reports.values()))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'folds': args.folds, 'seed': args.seed, 'models': [report.to_dict() for report in reports.values()]}, f, indent=2)
+        print(f"\nReport saved at: {args.output}")
@@ -1,16 +1,20 @@
 import os
-import librosa
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from audio_io import load_audio
+from mel_frontend import get_frontend
 import numpy as np
 import tensorflow as tf
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import confusion_matrix, classification_report
 import matplotlib.pyplot as plt
+from feature_cache import shared_cache, DEFAULT_CACHE_DIR
+from augmentation import SpectrogramAugmenter
 
 # Step 1: Extract Mel Spectrograms
 def extract_mel_spectrogram(audio_file, n_mels=128, n_fft=2048, hop_length=512):
-    y, sr = librosa.load(audio_file, sr=None)
-    spectrogram = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=n_mels, n_fft=n_fft, hop_length=hop_length)
-    log_spectrogram = librosa.power_to_db(spectrogram, ref=np.max)
+    y, sr = load_audio(audio_file, sr=None)
+    log_spectrogram = get_frontend(sr, n_fft, hop_length, n_mels)(y)  # Same as librosa.power_to_db(melspectrogram, ref=np.max)
     return log_spectrogram
 
 # Define pad_spectrogram to pad spectrograms to a consistent length
@@ -22,48 +26,141 @@ def pad_spectrogram(spec, max_len=128):
         spec = spec[:, :max_len]
     return spec
 
-# Step 2: Prepare the dataset
-def prepare_dataset(confident_dir, doubtful_dir, max_pad_len=128):
-    spectrograms = []
+# List the .wav files of both classes in a fixed (sorted) order, with their labels
+def list_labelled_files(confident_dir, doubtful_dir):
+    file_paths = []
     labels = []
+    for directory, label in ((confident_dir, 1), (doubtful_dir, 0)):  # 1 for confident, 0 for doubtful
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith('.wav'):
+                file_paths.append(os.path.join(directory, filename))
+                labels.append(label)
+    return file_paths, labels
 
-    # Process confident files
-    for filename in os.listdir(confident_dir):
-        if filename.endswith('.wav'):
-            file_path = os.path.join(confident_dir, filename)
-            spectrogram = extract_mel_spectrogram(file_path)
-            spectrogram = pad_spectrogram(spectrogram, max_pad_len)
-            spectrograms.append(spectrogram)
-            labels.append(1)  # 1 for confident
-
-    # Process doubtful files
-    for filename in os.listdir(doubtful_dir):
-        if filename.endswith('.wav'):
-            file_path = os.path.join(doubtful_dir, filename)
-            spectrogram = extract_mel_spectrogram(file_path)
-            spectrogram = pad_spectrogram(spectrogram, max_pad_len)
-            spectrograms.append(spectrogram)
-            labels.append(0)  # 0 for doubtful
-
-    spectrograms = np.array(spectrograms)
-    labels = np.array(labels)
+# Step 2: Prepare the dataset
+# Spectrograms are cached in cache_dir, so that later runs skip decoding the audio; pass cache_dir=None to disable the cache
+# Files that are not cached are processed by n_workers processes, which receive chunk_size files at a time
+def prepare_dataset(confident_dir, doubtful_dir, max_pad_len=128, cache_dir=DEFAULT_CACHE_DIR, n_workers=1, chunk_size=16, n_mels=128):
+    file_paths, labels = list_labelled_files(confident_dir, doubtful_dir)
+    cache = shared_cache(cache_dir, n_mels=n_mels, max_pad_len=max_pad_len) if cache_dir is not None else None
+
+    # Spectrograms are written straight into the output array, with a channel dimension for the CNN input
+    spectrograms = np.empty((len(file_paths), n_mels, max_pad_len, 1), dtype=np.float32)
+    missing = []
+    for i, file_path in enumerate(file_paths):
+        cached = cache.get(file_path) if cache is not None else None
+        if cached is None:
+            missing.append(i)
+        else:
+            spectrograms[i, :, :, 0] = cached
+
+    missing_paths = [file_paths[i] for i in missing]
+    if n_workers > 1 and len(missing) > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = executor.map(extract_padded_spectrogram, missing_paths, repeat(max_pad_len), repeat(n_mels), chunksize=chunk_size)
+            for i, spectrogram in zip(missing, results):
+                spectrograms[i, :, :, 0] = spectrogram
+    else:
+        for i, file_path in zip(missing, missing_paths):
+            spectrograms[i, :, :, 0] = extract_padded_spectrogram(file_path, max_pad_len, n_mels)
+
+    if cache is not None:
+        for i, file_path in zip(missing, missing_paths):
+            cache.put(file_path, spectrograms[i, :, :, 0])
+        cache.flush()
+
+    return spectrograms, np.array(labels)
+
+# Worker function for prepare_dataset (defined at module level so it can be sent to worker processes)
+def extract_padded_spectrogram(file_path, max_pad_len=128, n_mels=128):
+    return pad_spectrogram(extract_mel_spectrogram(file_path, n_mels=n_mels), max_pad_len).astype(np.float32)
+
+# Split the file indexes (rather than copies of the features) into training and validation sets
+def split_file_indexes(n_files, test_size=0.2, random_state=42):
+    return train_test_split(np.arange(n_files), test_size=test_size, random_state=random_state)
+
+# Streaming alternative to prepare_dataset: spectrograms are loaded lazily (from the feature cache if possible),
+# shuffled with a bounded buffer, batched and prefetched while the model trains, so the corpus does not have to fit in memory
+# augment is applied to each batch on the tf.data threads, e.g. a SpectrogramAugmenter from augmentation.py (for training sets only)
+def make_dataset(file_paths, labels, max_pad_len=128, cache_dir=DEFAULT_CACHE_DIR, batch_size=32, shuffle=True,
+                 shuffle_buffer=1024, seed=42, n_mels=128, augment=None):
+    cache = shared_cache(cache_dir, n_mels=n_mels, max_pad_len=max_pad_len) if cache_dir is not None else None  # Flushed at exit
+
+    def load(file_path):
+        file_path = file_path.decode()
+        if cache is None:
+            return extract_padded_spectrogram(file_path, max_pad_len, n_mels)
+        return np.array(cache.get_or_compute(file_path, lambda path: extract_padded_spectrogram(path, max_pad_len, n_mels)))
+
+    def load_example(file_path, label):
+        spectrogram = tf.numpy_function(load, [file_path], tf.float32)
+        spectrogram = tf.reshape(spectrogram, (n_mels, max_pad_len, 1))  # Add channel dimension
+        return spectrogram, label
 
-    # Reshape the spectrograms for CNN input (Add channel dimension)
-    spectrograms = spectrograms[..., np.newaxis]
+    dataset = tf.data.Dataset.from_tensor_slices((np.asarray(file_paths), np.asarray(labels)))
+    if shuffle:
+        dataset = dataset.shuffle(min(shuffle_buffer, len(file_paths)), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.map(load_example, num_parallel_calls=tf.data.AUTOTUNE).batch(batch_size)
+    if augment is not None:
+        dataset = dataset.map(lambda spectrograms, labels: (augment(spectrograms), labels), num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
 
-    return spectrograms, labels
+# Variable-length features: the spectrogram is truncated to max_len frames, but not padded
+def extract_truncated_spectrogram(file_path, max_len=512, n_mels=128):
+    return extract_mel_spectrogram(file_path, n_mels=n_mels)[:, :max_len].astype(np.float32)
+
+# Bucketed alternative to make_dataset, for models created with global_pooling=True: clips are grouped into buckets by
+# their number of frames, and each batch is only padded to its longest clip instead of to a fixed length.
+# Clips are truncated to max_len frames and padded to at least min_len frames (the narrowest input the conv/pool blocks accept).
+# Batches come out grouped by bucket, so evaluate with evaluate_model(model, dataset, None). augment is applied as in make_dataset.
+# The variable-length spectrograms are cached in their own subdirectory of cache_dir, next to the fixed-length ones.
+def make_bucketed_dataset(file_paths, labels, bucket_boundaries=(64, 128, 256), max_len=512, min_len=32, cache_dir=DEFAULT_CACHE_DIR,
+                          batch_size=32, shuffle=True, shuffle_buffer=1024, seed=42, n_mels=128, augment=None):
+    cache = None
+    if cache_dir is not None:
+        cache = shared_cache(os.path.join(cache_dir, 'variable_length'), n_mels=n_mels, max_pad_len=max_len, variable_length=True)
+
+    def load(file_path):
+        file_path = file_path.decode()
+        if cache is None:
+            spectrogram = extract_truncated_spectrogram(file_path, max_len, n_mels)
+        else:
+            spectrogram = np.array(cache.get_or_compute(file_path, lambda path: extract_truncated_spectrogram(path, max_len, n_mels)))
+        return pad_spectrogram(spectrogram, max(min_len, spectrogram.shape[1]))
+
+    def load_example(file_path, label):
+        spectrogram = tf.numpy_function(load, [file_path], tf.float32)
+        spectrogram = tf.reshape(spectrogram, (n_mels, -1, 1))  # Add channel dimension
+        return spectrogram, label
+
+    dataset = tf.data.Dataset.from_tensor_slices((np.asarray(file_paths), np.asarray(labels)))
+    if shuffle:
+        dataset = dataset.shuffle(min(shuffle_buffer, len(file_paths)), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.map(load_example, num_parallel_calls=tf.data.AUTOTUNE)
+    dataset = dataset.bucket_by_sequence_length(lambda spectrogram, label: tf.shape(spectrogram)[1],
+                                                bucket_boundaries=list(bucket_boundaries),
+                                                bucket_batch_sizes=[batch_size] * (len(bucket_boundaries) + 1))
+    if augment is not None:
+        dataset = dataset.map(lambda spectrograms, labels: (augment(spectrograms), labels), num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
 
 # Step 3: Define the CNN model
-def create_cnn_model(input_shape):
-    model = tf.keras.Sequential([
-        tf.keras.layers.Conv2D(32, (3, 3), activation='relu', input_shape=input_shape),
-        tf.keras.layers.MaxPooling2D((2, 2)),
-        tf.keras.layers.Conv2D(64, (3, 3), activation='relu'),
-        tf.keras.layers.MaxPooling2D((2, 2)),
-        tf.keras.layers.Conv2D(128, (3, 3), activation='relu'),
-        tf.keras.layers.MaxPooling2D((2, 2)),
-        tf.keras.layers.Flatten(),
-        tf.keras.layers.Dense(128, activation='relu'),
+# With global_pooling, the features are averaged over time instead of flattened, so the number of frames can vary (input_shape=(n_mels, None, 1))
+# filters sets the number of conv/pool blocks and their widths; with separable, all but the first block use depthwise-separable convolutions
+def create_cnn_model(input_shape, global_pooling=False, filters=(32, 64, 128), separable=False, dense_units=128):
+    layers = []
+    for i, n_filters in enumerate(filters):
+        if i == 0:
+            layers.append(tf.keras.layers.Conv2D(n_filters, (3, 3), activation='relu', input_shape=input_shape))
+        elif separable:
+            layers.append(tf.keras.layers.SeparableConv2D(n_filters, (3, 3), activation='relu'))
+        else:
+            layers.append(tf.keras.layers.Conv2D(n_filters, (3, 3), activation='relu'))
+        layers.append(tf.keras.layers.MaxPooling2D((2, 2)))
+
+    model = tf.keras.Sequential(layers + [
+        tf.keras.layers.GlobalAveragePooling2D() if global_pooling else tf.keras.layers.Flatten(),
+        tf.keras.layers.Dense(dense_units, activation='relu'),
         tf.keras.layers.Dropout(0.3),
         tf.keras.layers.Dense(2, activation='softmax')  # Two classes: Confident and Doubtful
     ])
@@ -72,7 +169,10 @@ def create_cnn_model(input_shape):
     return model
 
 # Step 4: Train the CNN model
+# X_train and X_val can also be datasets from make_dataset, in which case y_train and y_val are not used
 def train_cnn_model(model, X_train, y_train, X_val, y_val, epochs=20, batch_size=32):
+    if isinstance(X_train, tf.data.Dataset):
+        return model.fit(X_train, validation_data=X_val, epochs=epochs)
     history = model.fit(X_train, y_train, validation_data=(X_val, y_val), epochs=epochs, batch_size=batch_size)
     return history
 
@@ -94,12 +194,21 @@ def fine_tune_model(model, X_train, y_train, X_val, y_val, fine_tune_epochs=10,
                   loss='sparse_categorical_crossentropy', metrics=['accuracy'])
     
     # Fine-tune the model
+    if isinstance(X_train, tf.data.Dataset):
+        return model.fit(X_train, validation_data=X_val, epochs=fine_tune_epochs)
     history = model.fit(X_train, y_train, validation_data=(X_val, y_val), epochs=fine_tune_epochs)
     return history
 
 # Step 8: Evaluate model on the validation data
+# X_val can also be an unshuffled dataset from make_dataset, with y_val the labels in the same order,
+# or any dataset with y_val=None, in which case the labels are taken from the dataset itself
 def evaluate_model(model, X_val, y_val):
-    predictions = model.predict(X_val)
+    if y_val is None:
+        batches = [(model.predict_on_batch(x), y.numpy()) for x, y in X_val]
+        predictions = np.concatenate([p for p, _ in batches])
+        y_val = np.concatenate([y for _, y in batches])
+    else:
+        predictions = model.predict(X_val)
     predicted_classes = np.argmax(predictions, axis=1)
 
     # Confusion matrix and classification report
@@ -123,31 +232,35 @@ if __name__ == "__main__":
     confident_dir = 'speech_recognition/Data/confident/'
     doubtful_dir = 'speech_recognition/Data/doubtful/'
 
-    # Prepare dataset
-    X, y = prepare_dataset(confident_dir, doubtful_dir)
-
-    # Split dataset into training and validation sets
-    X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=0.2, random_state=42)
+    # List the dataset and split it by file index; features are streamed from disk during training
+    file_paths, labels = list_labelled_files(confident_dir, doubtful_dir)
+    labels = np.array(labels)
+    train_idx, val_idx = split_file_indexes(len(file_paths))
+    train_dataset = make_dataset([file_paths[i] for i in train_idx], labels[train_idx], augment=SpectrogramAugmenter())
+    val_dataset = make_dataset([file_paths[i] for i in val_idx], labels[val_idx], shuffle=False)
 
     # Define input shape (based on mel spectrogram dimensions)
-    input_shape = X_train.shape[1:]  # (n_mels, max_pad_len, 1)
+    input_shape = tuple(train_dataset.element_spec[0].shape[1:])  # (n_mels, max_pad_len, 1)
 
     # Step 1: Train and save the CNN model
     cnn_model = create_cnn_model(input_shape)
-    history = train_cnn_model(cnn_model, X_train, y_train, X_val, y_val)
+    history = train_cnn_model(cnn_model, train_dataset, None, val_dataset, None)
     save_model(cnn_model, "cnn_model.h5")
 
     # Step 2: Load the saved model and fine-tune it on a smaller dataset
     loaded_model = load_model("cnn_model.h5")
-    evaluate_model(loaded_model, X_val, y_val)
+    evaluate_model(loaded_model, val_dataset, labels[val_idx])
 
     confident_dir_finetune = 'speech_recognition/Recordings/confident/'
     doubtful_dir_finetune = 'speech_recognition/Recordings/doubtful/'
-    X_fine, y_fine = prepare_dataset(confident_dir_finetune, doubtful_dir_finetune)
-    
+    fine_paths, fine_labels = list_labelled_files(confident_dir_finetune, doubtful_dir_finetune)
+    fine_labels = np.array(fine_labels)
+
     # Fine-tune on a smaller set of data (this could be a new dataset or a subset of the original)
-    X_train_fine, X_val_fine, y_train_fine, y_val_fine = train_test_split(X_fine, y_fine, test_size=0.2)  # Example small set
-    fine_tune_history = fine_tune_model(loaded_model, X_train_fine, y_train_fine, X_val_fine, y_val_fine, fine_tune_epochs=10)
-    
+    train_idx_fine, val_idx_fine = split_file_indexes(len(fine_paths), random_state=None)  # Example small set
+    train_dataset_fine = make_dataset([fine_paths[i] for i in train_idx_fine], fine_labels[train_idx_fine], augment=SpectrogramAugmenter())
+    val_dataset_fine = make_dataset([fine_paths[i] for i in val_idx_fine], fine_labels[val_idx_fine], shuffle=False)
+    fine_tune_history = fine_tune_model(loaded_model, train_dataset_fine, None, val_dataset_fine, None, fine_tune_epochs=10)
+
     # Evaluate the fine-tuned model
-    evaluate_model(loaded_model, X_val_fine, y_val_fine)
\ No newline at end of file
+    evaluate_model(loaded_model, val_dataset_fine, fine_labels[val_idx_fine])
\ No newline at end of file
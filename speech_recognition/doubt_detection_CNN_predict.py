@@ -1,18 +1,64 @@
 import os
+import csv
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import numpy as np
-import tensorflow as tf
-import librosa
+from audio_io import load_audio
+from mel_frontend import get_frontend
 
 # Define necessary functions (load, extract mel spectrogram, pad spectrogram, etc.)
+# TensorFlow is only imported when it is needed, so that quantized models can be run with just the TFLite runtime
 def load_model(model_path="cnn_model-best.h5"):
-    loaded_model = tf.keras.models.load_model(model_path)
+    if model_path.endswith('.tflite'):
+        loaded_model = TFLiteModel(model_path)
+    else:
+        import tensorflow as tf
+        loaded_model = tf.keras.models.load_model(model_path)
     print(f"Model loaded from: {model_path}")
     return loaded_model
 
+# Runs a TFLite model (e.g. a quantized export from export_tflite.py) with the same predict interface as a Keras model
+# Uses the lightweight tflite_runtime package if it is installed, and TensorFlow's interpreter otherwise
+class TFLiteModel:
+    def __init__(self, model_path):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(model_path=model_path)
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.input_shape = None
+
+    def predict_on_batch(self, x):
+        x = np.asarray(x, dtype=np.float32)
+        if self.input_shape != x.shape:
+            self.interpreter.resize_tensor_input(self.input['index'], x.shape)
+            self.interpreter.allocate_tensors()
+            self.input_shape = x.shape
+
+        # Models with integer inputs and outputs are (de)quantized here
+        scale, zero_point = self.input['quantization']
+        if self.input['dtype'] != np.float32:
+            limits = np.iinfo(self.input['dtype'])
+            x = np.clip(np.round(x / scale + zero_point), limits.min, limits.max).astype(self.input['dtype'])
+        self.interpreter.set_tensor(self.input['index'], x)
+        self.interpreter.invoke()
+        y = self.interpreter.get_tensor(self.output['index'])
+        scale, zero_point = self.output['quantization']
+        if self.output['dtype'] != np.float32:
+            y = (y.astype(np.float32) - zero_point) * scale
+        return np.array(y, dtype=np.float32)
+
+    def predict(self, x, batch_size=32, verbose=0):
+        return np.concatenate([self.predict_on_batch(x[i:i + batch_size]) for i in range(0, len(x), batch_size)])
+
 def extract_mel_spectrogram(audio_file, n_mels=128, n_fft=2048, hop_length=512):
-    y, sr = librosa.load(audio_file, sr=None)
-    spectrogram = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=n_mels, n_fft=n_fft, hop_length=hop_length)
-    log_spectrogram = librosa.power_to_db(spectrogram, ref=np.max)
+    y, sr = load_audio(audio_file, sr=None)
+    log_spectrogram = get_frontend(sr, n_fft, hop_length, n_mels)(y)  # Same as librosa.power_to_db(melspectrogram, ref=np.max)
     return log_spectrogram
 
 def pad_spectrogram(spec, max_len=128):
@@ -23,11 +69,17 @@ def pad_spectrogram(spec, max_len=128):
         spec = spec[:, :max_len]
     return spec
 
-def predict_confidence(model, audio_file, max_pad_len=128):
-    spectrogram = extract_mel_spectrogram(audio_file)
-    spectrogram = pad_spectrogram(spectrogram, max_pad_len)
-    spectrogram = np.expand_dims(spectrogram, axis=-1)  # Add channel dimension
-    spectrogram = np.expand_dims(spectrogram, axis=0)    # Add batch dimension
+# With variable_length, for models trained on bucketed batches (create_cnn_model(..., global_pooling=True)), the clip is truncated
+# to max_len frames instead of padded or truncated to max_pad_len, and padded to the width of its bucket
+def predict_confidence(model, audio_file, max_pad_len=128, variable_length=False, bucket_boundaries=(64, 128, 256), max_len=512):
+    if variable_length:
+        spectrogram = extract_truncated_spectrogram(audio_file, max_len)
+        spectrogram = stack_spectrograms([spectrogram], bucket_width(spectrogram.shape[1], bucket_boundaries, max_len))
+    else:
+        spectrogram = extract_mel_spectrogram(audio_file)
+        spectrogram = pad_spectrogram(spectrogram, max_pad_len)
+        spectrogram = np.expand_dims(spectrogram, axis=-1)  # Add channel dimension
+        spectrogram = np.expand_dims(spectrogram, axis=0)    # Add batch dimension
 
     prediction = model.predict(spectrogram)
     predicted_class = np.argmax(prediction, axis=1)[0]  # 0 = Doubtful, 1 = Confident
@@ -37,9 +89,126 @@ def predict_confidence(model, audio_file, max_pad_len=128):
     else:
         return "Doubtful"
 
+LABELS = ["Doubtful", "Confident"]
+
+# Features of a single input: an audio file path, or a mel spectrogram that was already extracted
+def extract_padded_spectrogram(audio, max_pad_len=128):
+    spectrogram = extract_mel_spectrogram(audio) if isinstance(audio, (str, os.PathLike)) else audio
+    return pad_spectrogram(spectrogram, max_pad_len).astype(np.float32)
+
+# Variable-length features of a single input: truncated to max_len frames, and only padded up to min_len frames
+# (the narrowest input the conv/pool blocks accept), as in make_bucketed_dataset
+def extract_truncated_spectrogram(audio, max_len=512, min_len=32):
+    spectrogram = extract_mel_spectrogram(audio) if isinstance(audio, (str, os.PathLike)) else audio
+    spectrogram = spectrogram[:, :max_len]
+    return pad_spectrogram(spectrogram, max(min_len, spectrogram.shape[1])).astype(np.float32)
+
+# Width a batch of variable-length spectrograms is padded to: the first bucket boundary that fits its longest clip (max_len beyond the last one),
+# so the model only sees len(bucket_boundaries) + 1 input widths and is not retraced for every clip length
+def bucket_width(n_frames, bucket_boundaries=(64, 128, 256), max_len=512):
+    for boundary in sorted(bucket_boundaries):
+        if n_frames <= boundary:
+            return boundary
+    return max_len
+
+# Stack spectrograms of different widths into one batch with a channel dimension, zero-padded to width frames
+def stack_spectrograms(spectrograms, width):
+    features = np.zeros((len(spectrograms), spectrograms[0].shape[0], width, 1), dtype=np.float32)
+    for i, spectrogram in enumerate(spectrograms):
+        features[i, :, :spectrogram.shape[1], 0] = spectrogram
+    return features
+
+# Score variable-length spectrograms: clips are sorted by width, so that each batch holds clips of similar length,
+# and every batch is padded to the width of its bucket; returns the probabilities in input order
+def predict_variable_length(model, spectrograms, batch_size=64, bucket_boundaries=(64, 128, 256), max_len=512):
+    widths = np.array([spectrogram.shape[1] for spectrogram in spectrograms])
+    buckets = np.array([bucket_width(w, bucket_boundaries, max_len) for w in widths])
+    probabilities = np.empty((len(spectrograms), len(LABELS)), dtype=np.float32)
+    for width in np.unique(buckets):
+        indexes = np.flatnonzero(buckets == width)
+        indexes = indexes[np.argsort(widths[indexes], kind='stable')]
+        for start in range(0, len(indexes), batch_size):
+            batch = indexes[start:start + batch_size]
+            probabilities[batch] = model.predict_on_batch(stack_spectrograms([spectrograms[i] for i in batch], int(width)))
+    return probabilities
+
+# Classify many inputs (audio file paths or mel spectrograms) at once
+# Inputs are processed in blocks of block_size: while the model scores one block in batches of batch_size,
+# n_workers processes extract the features of the next block
+# With variable_length, clips are truncated to max_len frames instead of padded to max_pad_len, and scored in bucketed batches (see predict_variable_length)
+# Returns the predicted labels and the class probabilities (columns: Doubtful, Confident) in input order
+def predict_confidence_batch(model, inputs, max_pad_len=128, batch_size=64, block_size=1024, n_workers=1, chunk_size=16,
+                             variable_length=False, bucket_boundaries=(64, 128, 256), max_len=512):
+    inputs = list(inputs)
+    blocks = [inputs[i:i + block_size] for i in range(0, len(inputs), block_size)]
+    probabilities = np.empty((len(inputs), len(LABELS)), dtype=np.float32)
+
+    executor = ProcessPoolExecutor(max_workers=n_workers) if n_workers > 1 and len(inputs) > 1 else None
+    extract_features, length = (extract_truncated_spectrogram, max_len) if variable_length else (extract_padded_spectrogram, max_pad_len)
+    def extract(block):
+        if executor is None:
+            return (extract_features(audio, length) for audio in block)
+        return executor.map(extract_features, block, repeat(length), chunksize=chunk_size)
+
+    try:
+        pending = extract(blocks[0]) if blocks else None
+        features = None
+        for b, block in enumerate(blocks):
+            spectrograms = list(pending)
+            if b + 1 < len(blocks):
+                pending = extract(blocks[b + 1])
+
+            start = b * block_size
+            if variable_length:
+                probabilities[start:start + len(block)] = predict_variable_length(model, spectrograms, batch_size, bucket_boundaries, max_len)
+                continue
+
+            if features is None:
+                features = np.empty((len(block),) + spectrograms[0].shape + (1,), dtype=np.float32)
+            for i, spectrogram in enumerate(spectrograms):
+                features[i, :, :, 0] = spectrogram
+            probabilities[start:start + len(block)] = model.predict(features[:len(block)], batch_size=batch_size, verbose=0)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    predicted_classes = np.argmax(probabilities, axis=1)  # 0 = Doubtful, 1 = Confident
+    return [LABELS[c] for c in predicted_classes], probabilities
+
+# Score all .wav files in a folder and write the results to a CSV file
+def score_folder(model, folder, output_path, batch_size=64, n_workers=1, variable_length=False):
+    file_paths = [os.path.join(folder, filename) for filename in sorted(os.listdir(folder)) if filename.endswith('.wav')]
+
+    start = time.perf_counter()
+    labels, probabilities = predict_confidence_batch(model, file_paths, batch_size=batch_size, n_workers=n_workers, variable_length=variable_length)
+    duration = time.perf_counter() - start
+
+    with open(output_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['file', 'label', 'p_doubtful', 'p_confident'])
+        for file_path, label, p in zip(file_paths, labels, probabilities):
+            writer.writerow([file_path, label, f"{p[0]:.6f}", f"{p[1]:.6f}"])
+
+    print(f"Scored {len(file_paths)} files in {duration:.1f} s ({len(file_paths) / max(duration, 1e-9):.1f} files/sec)")
+    print(f"Results saved at: {output_path}")
+    return labels, probabilities
+
 # Example usage
-os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
-audio_file = 'speech_recognition/microphone-results.wav'  # Provide path to new audio file
-loaded_model = load_model("cnn_model-best.h5")
-confidence_level = predict_confidence(loaded_model, audio_file)
-print(f"The input file is classified as: {confidence_level}")
\ No newline at end of file
+if __name__ == "__main__":
+    os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
+    parser = argparse.ArgumentParser(description="Classify recordings as confident or doubtful")
+    parser.add_argument("folder", nargs="?", help="folder of .wav files to score (classifies the example recording if omitted)")
+    parser.add_argument("--output", default="predictions.csv", help="CSV file to write the scores to")
+    parser.add_argument("--model", default="cnn_model-best.h5", help="Keras model, or a .tflite model from export_tflite.py")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of feature extraction processes")
+    parser.add_argument("--variable-length", action="store_true", help="score full-length clips in bucketed batches (models trained with global pooling)")
+    args = parser.parse_args()
+
+    loaded_model = load_model(args.model)
+    if args.folder is None:
+        audio_file = 'speech_recognition/microphone-results.wav'  # Provide path to new audio file
+        confidence_level = predict_confidence(loaded_model, audio_file, variable_length=args.variable_length)
+        print(f"The input file is classified as: {confidence_level}")
+    else:
+        score_folder(loaded_model, args.folder, args.output, args.batch_size, args.workers, args.variable_length)
@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+import urllib.request
+from concurrent.futures import Future, TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+from doubt_detection_CNN_predict import load_model, extract_padded_spectrogram, extract_truncated_spectrogram, bucket_width, stack_spectrograms, LABELS
+
+# Long-running local inference service for the doubt CNN.
+# The model is loaded and warmed up once; concurrent requests are coalesced into micro-batches,
+# so the flashcard app and batch jobs can share one warm model.
+#
+# Start the server:
+#     python speech_recognition/doubt_server.py --model cnn_model-best.h5 --port 8765
+# Classify files from another process:
+#     classify(['speech_recognition/microphone-results.wav'])
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+
+# Collects spectrograms from concurrent requests and scores them together
+# A batch is run as soon as it holds max_batch_size inputs, or max_latency seconds after its first input arrived
+# With bucket_boundaries, spectrograms may differ in width, and each batch is padded to the bucket width of its longest clip
+class MicroBatcher:
+    def __init__(self, model, max_batch_size=32, max_latency=0.01, bucket_boundaries=None, max_len=512):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.bucket_boundaries = bucket_boundaries
+        self.max_len = max_len
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Queue a spectrogram and return a Future with its class probabilities
+    def submit(self, spectrogram):
+        future = Future()
+        self.requests.put((spectrogram, future))
+        return future
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.perf_counter() + self.max_latency
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                spectrograms = [spectrogram for spectrogram, _ in batch]
+                if self.bucket_boundaries is None:
+                    features = np.stack(spectrograms)[..., np.newaxis]
+                else:
+                    width = bucket_width(max(spectrogram.shape[1] for spectrogram in spectrograms), self.bucket_boundaries, self.max_len)
+                    features = stack_spectrograms(spectrograms, width)
+                probabilities = np.asarray(self.model.predict_on_batch(features))
+                for (_, future), p in zip(batch, probabilities):
+                    future.set_result(p)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+
+# Run the model once for every batch size (and, for variable-length input, every bucket width) it will see,
+# so that the first requests do not pay for graph tracing
+def warm_up(model, max_batch_size, widths=(128,), n_mels=128):
+    for width in widths:
+        batch_size = 1
+        while batch_size <= max_batch_size:
+            model.predict_on_batch(np.zeros((batch_size, n_mels, width, 1), dtype=np.float32))
+            batch_size *= 2
+
+
+class DoubtRequestHandler(BaseHTTPRequestHandler):
+    # GET /health returns the server configuration
+    def do_GET(self):
+        if self.path != '/health':
+            self.send_json(404, {'error': f"Unknown path: {self.path}"})
+            return
+        batcher = self.server.batcher
+        self.send_json(200, {'status': 'ok', 'max_batch_size': batcher.max_batch_size, 'max_latency_ms': batcher.max_latency * 1000,
+                             'variable_length': batcher.bucket_boundaries is not None})
+
+    # POST /predict with {"files": [...]} returns a label and probabilities per file, in the same order
+    # Invalid request bodies and missing files are client errors (400); failures of feature extraction or the model are server errors (500),
+    # and a request whose batch does not finish within the request timeout gets a 503
+    def do_POST(self):
+        if self.path != '/predict':
+            self.send_json(404, {'error': f"Unknown path: {self.path}"})
+            return
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            files = body['files']
+            if not isinstance(files, list) or not all(isinstance(file_path, str) for file_path in files):
+                raise ValueError("'files' must be a list of paths")
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {'error': f"Invalid request: {type(e).__name__}: {e}"})
+            return
+
+        missing = [file_path for file_path in files if not os.path.isfile(file_path)]
+        if missing:
+            self.send_json(400, {'error': f"Files not found: {', '.join(missing)}"})
+            return
+
+        try:
+            futures = [self.server.batcher.submit(self.server.extract(file_path)) for file_path in files]
+            deadline = time.perf_counter() + self.server.request_timeout
+            probabilities = [future.result(timeout=max(0, deadline - time.perf_counter())) for future in futures]
+        except TimeoutError:
+            self.send_json(503, {'error': f"Inference did not finish within {self.server.request_timeout} s"})
+            return
+        except Exception as e:
+            self.send_json(500, {'error': f"Inference failed: {type(e).__name__}: {e}"})
+            return
+
+        self.send_json(200, {'predictions': [{'file': file_path,
+                                              'label': LABELS[int(np.argmax(p))],
+                                              'p_doubtful': float(p[0]),
+                                              'p_confident': float(p[1])} for file_path, p in zip(files, probabilities)]})
+
+    def send_json(self, status, content):
+        data = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# With variable_length, for models trained on bucketed batches (create_cnn_model(..., global_pooling=True)), clips are truncated to max_len
+# frames instead of padded or truncated to max_pad_len, and batches are padded to the bucket width of their longest clip
+def serve(model_path="cnn_model-best.h5", host=DEFAULT_HOST, port=DEFAULT_PORT, max_batch_size=32, max_latency_ms=10, max_pad_len=128,
+          request_timeout=30, variable_length=False, bucket_boundaries=(64, 128, 256), max_len=512):
+    model = load_model(model_path)
+    server = ThreadingHTTPServer((host, port), DoubtRequestHandler)
+    if variable_length:
+        warm_up(model, max_batch_size, sorted(set(bucket_boundaries)) + [max_len])
+        server.batcher = MicroBatcher(model, max_batch_size, max_latency_ms / 1000, bucket_boundaries, max_len)
+        server.extract = lambda file_path: extract_truncated_spectrogram(file_path, max_len)
+    else:
+        warm_up(model, max_batch_size, (max_pad_len,))
+        server.batcher = MicroBatcher(model, max_batch_size, max_latency_ms / 1000)
+        server.extract = lambda file_path: extract_padded_spectrogram(file_path, max_pad_len)
+    server.request_timeout = request_timeout
+    print(f"Serving doubt detection on http://{host}:{port} (batches of up to {max_batch_size}, {max_latency_ms} ms latency budget)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# Client: classify audio files with a running server, returns a list of (label, p_confident) tuples
+def classify(files, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=30):
+    request = urllib.request.Request(f"http://{host}:{port}/predict",
+                                     data=json.dumps({'files': [os.path.abspath(f) for f in files]}).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        predictions = json.loads(response.read())['predictions']
+    return [(p['label'], p['p_confident']) for p in predictions]
+
+
+if __name__ == "__main__":
+    os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
+    parser = argparse.ArgumentParser(description="Serve the doubt detection CNN on localhost")
+    parser.add_argument("--model", default="cnn_model-best.h5")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-latency-ms", type=float, default=10, help="how long a request may wait for other requests to batch with")
+    parser.add_argument("--request-timeout", type=float, default=30, help="seconds a request waits for its predictions before failing")
+    parser.add_argument("--variable-length", action="store_true", help="score full-length clips in bucketed batches (models trained with global pooling)")
+    args = parser.parse_args()
+    serve(args.model, args.host, args.port, args.max_batch_size, args.max_latency_ms, request_timeout=args.request_timeout,
+          variable_length=args.variable_length)
@@ -1,6 +1,8 @@
 import os
+from concurrent.futures import ProcessPoolExecutor
 import speech_recognition as sr
 import librosa
+from audio_io import load_audio
 import numpy as np
 from sklearn import svm
 from sklearn.model_selection import train_test_split
@@ -20,7 +22,7 @@ def transcribe_audio(audio_file):
 
 # Step 2: Extract acoustic features using librosa
 def extract_audio_features(audio_file):
-    y, sr = librosa.load(audio_file)
+    y, sr = load_audio(audio_file)
 
     # Extract pitch (fundamental frequency)
     pitches, magnitudes = librosa.core.piptrack(y=y, sr=sr)
@@ -38,33 +40,45 @@ def extract_audio_features(audio_file):
         'speech_duration': duration
     }
 
-# Step 3: Prepare dataset for training
-def prepare_dataset(confident_dir, doubtful_dir):
-    features = []
+# Feature vector used by the SVM (defined at module level so it can be sent to worker processes)
+def extract_feature_vector(audio_file):
+    feature = extract_audio_features(audio_file)
+    return [feature['mean_pitch'], feature['mean_volume'], feature['speech_duration']]
+
+# List the .wav files of both classes in a fixed (sorted) order, with their labels
+def list_labelled_files(confident_dir, doubtful_dir):
+    file_paths = []
     labels = []
+    for directory, label in ((confident_dir, 1), (doubtful_dir, 0)):  # 1 for confident, 0 for doubtful
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith('.wav'):
+                file_paths.append(os.path.join(directory, filename))
+                labels.append(label)
+    return file_paths, labels
 
-    # Process confident files
-    for filename in os.listdir(confident_dir):
-        if filename.endswith('.wav'):
-            file_path = os.path.join(confident_dir, filename)
-            feature = extract_audio_features(file_path)
-            features.append([feature['mean_pitch'], feature['mean_volume'], feature['speech_duration']])
-            labels.append(1)  # 1 for confident
+# Step 3: Prepare dataset for training
+# Files are processed by n_workers processes, which receive chunk_size files at a time
+def prepare_dataset(confident_dir, doubtful_dir, n_workers=1, chunk_size=16):
+    file_paths, labels = list_labelled_files(confident_dir, doubtful_dir)
+    features = np.empty((len(file_paths), 3), dtype=np.float32)
 
-    # Process doubtful files
-    for filename in os.listdir(doubtful_dir):
-        if filename.endswith('.wav'):
-            file_path = os.path.join(doubtful_dir, filename)
-            feature = extract_audio_features(file_path)
-            features.append([feature['mean_pitch'], feature['mean_volume'], feature['speech_duration']])
-            labels.append(0)  # 0 for doubtful
+    if n_workers > 1 and len(file_paths) > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            for i, feature in enumerate(executor.map(extract_feature_vector, file_paths, chunksize=chunk_size)):
+                features[i] = feature
+    else:
+        for i, file_path in enumerate(file_paths):
+            features[i] = extract_feature_vector(file_path)
 
-    return np.array(features), np.array(labels)
+    return features, np.array(labels)
 
 # Step 4: Train the SVM model
+def create_svm_model():
+    return svm.SVC(kernel='linear')  # You can also experiment with other kernels
+
 def train_svm_model(features, labels):
     X_train, X_test, y_train, y_test = train_test_split(features, labels, test_size=0.2, random_state=42)
-    clf = svm.SVC(kernel='linear')  # You can also experiment with other kernels
+    clf = create_svm_model()
     clf.fit(X_train, y_train)
 
     # Evaluate the model
@@ -88,7 +102,7 @@ if __name__ == "__main__":
     doubtful_dir = 'speech_recognition/Data/doubtful/'
 
     # Prepare dataset and train SVM model
-    features, labels = prepare_dataset(confident_dir, doubtful_dir)
+    features, labels = prepare_dataset(confident_dir, doubtful_dir, n_workers=os.cpu_count())
     svm_model = train_svm_model(features, labels)
 
     # output explanation:
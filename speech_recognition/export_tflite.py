@@ -0,0 +1,160 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+    import ctypes
+    from ctypes import wintypes
+
+# Export a trained doubt CNN to a quantized TFLite model for CPU-only machines, check its accuracy against the Keras model
+# on the held-out split, and benchmark the latency and memory use of both.
+#
+# Usage:
+#     python speech_recognition/export_tflite.py --model cnn_model-best.h5 --mode int8 --output cnn_model-int8.tflite
+# The exported model can be used anywhere a Keras model is loaded with doubt_detection_CNN_predict.load_model.
+MODES = ('int8', 'float16', 'float32')
+
+
+# Step 1: Convert the Keras model; int8 quantization calibrates the activation ranges on representative spectrograms
+def convert_model(model, mode='int8', representative_data=None):
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if mode == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == 'int8':
+        if representative_data is None:
+            raise ValueError("int8 quantization needs representative data")
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.representative_dataset = lambda: ([x[np.newaxis].astype(np.float32)] for x in representative_data)
+    return converter.convert()
+
+
+# Step 2: Compare the predictions of the Keras and TFLite models on held-out data
+def check_accuracy(keras_model, tflite_model, X, y, batch_size=32):
+    keras_probabilities = keras_model.predict(X, batch_size=batch_size, verbose=0)
+    tflite_probabilities = tflite_model.predict(X, batch_size=batch_size)
+    keras_classes = np.argmax(keras_probabilities, axis=1)
+    tflite_classes = np.argmax(tflite_probabilities, axis=1)
+    return {
+        'n': int(len(y)),
+        'keras_accuracy': float(np.mean(keras_classes == y)),
+        'tflite_accuracy': float(np.mean(tflite_classes == y)),
+        'agreement': float(np.mean(keras_classes == tflite_classes)),
+        'max_probability_difference': float(np.max(np.abs(keras_probabilities - tflite_probabilities)))
+    }
+
+
+# Step 3: Benchmark a model in a fresh process, so that the memory use of one runtime does not affect the other
+def benchmark(model_path, n_runs=200, batch_size=1, input_shape=(128, 128, 1)):
+    command = [sys.executable, os.path.abspath(__file__), '--benchmark-only', model_path,
+               '--runs', str(n_runs), '--batch-size', str(batch_size), '--input-shape', ','.join(map(str, input_shape))]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+# Peak resident memory of this process in MB (the peak working set on Windows)
+def peak_memory_mb():
+    if resource is None:
+        return windows_peak_working_set() / (1024 * 1024)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def windows_peak_working_set():
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + \
+                   [(name, ctypes.c_size_t) for name in ('PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                                                         'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    get_current_process = ctypes.windll.kernel32.GetCurrentProcess
+    get_current_process.restype = wintypes.HANDLE
+    get_process_memory_info = ctypes.windll.psapi.GetProcessMemoryInfo
+    get_process_memory_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters), wintypes.DWORD]
+    if not get_process_memory_info(get_current_process(), ctypes.byref(counters), counters.cb):
+        raise ctypes.WinError()
+    return counters.PeakWorkingSetSize
+
+
+def run_benchmark(model_path, n_runs, batch_size, input_shape):
+    from doubt_detection_CNN_predict import load_model
+
+    memory_before = peak_memory_mb()
+    start = time.perf_counter()
+    model = load_model(model_path)
+    load_time = time.perf_counter() - start
+
+    x = np.random.default_rng(0).normal(-40, 20, (batch_size,) + tuple(input_shape)).astype(np.float32)
+    for _ in range(5):
+        model.predict_on_batch(x)  # Warm up
+    latencies = []
+    for _ in range(n_runs):
+        start = time.perf_counter()
+        model.predict_on_batch(x)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        'model': model_path,
+        'file_size_mb': os.path.getsize(model_path) / (1024 * 1024),
+        'load_time_s': load_time,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'peak_memory_mb': peak_memory_mb(),
+        'model_memory_mb': peak_memory_mb() - memory_before
+    }
+
+
+if __name__ == "__main__":
+    os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
+    parser = argparse.ArgumentParser(description="Export the doubt CNN to a quantized TFLite model")
+    parser.add_argument("--model", default="cnn_model-best.h5")
+    parser.add_argument("--mode", default="int8", choices=MODES)
+    parser.add_argument("--output", help="TFLite file to write (defaults to the model name with the mode)")
+    parser.add_argument("--confident-dir", default='speech_recognition/Data/confident/')
+    parser.add_argument("--doubtful-dir", default='speech_recognition/Data/doubtful/')
+    parser.add_argument("--calibration-size", type=int, default=200, help="number of training spectrograms used to calibrate int8 quantization")
+    parser.add_argument("--runs", type=int, default=200, help="number of timed inferences per model")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--input-shape", default="128,128,1")
+    parser.add_argument("--benchmark-only", metavar="MODEL", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    input_shape = tuple(int(v) for v in args.input_shape.split(','))
+
+    if args.benchmark_only:
+        print(json.dumps(run_benchmark(args.benchmark_only, args.runs, args.batch_size, input_shape)))
+        sys.exit(0)
+
+    from doubt_detectionCNN import prepare_dataset, split_file_indexes, load_model as load_keras_model
+    from doubt_detection_CNN_predict import TFLiteModel
+
+    # Use the same split as training, so the accuracy check only sees held-out files
+    X, y = prepare_dataset(args.confident_dir, args.doubtful_dir, n_workers=os.cpu_count())
+    train_idx, val_idx = split_file_indexes(len(y))
+    calibration_idx = np.random.default_rng(0).permutation(train_idx)[:args.calibration_size]
+
+    keras_model = load_keras_model(args.model)
+    output_path = args.output or f"{os.path.splitext(args.model)[0]}-{args.mode}.tflite"
+    with open(output_path, 'wb') as f:
+        f.write(convert_model(keras_model, args.mode, X[calibration_idx]))
+    print(f"Quantized model saved at: {output_path}")
+
+    accuracy = check_accuracy(keras_model, TFLiteModel(output_path), X[val_idx], y[val_idx])
+    print(f"Held-out accuracy on {accuracy['n']} files: Keras {accuracy['keras_accuracy']:.3f}, TFLite ({args.mode}) {accuracy['tflite_accuracy']:.3f}")
+    print(f"Agreement between the models: {accuracy['agreement']:.3f} (largest probability difference {accuracy['max_probability_difference']:.4f})")
+
+    for model_path in (args.model, output_path):
+        result = benchmark(model_path, args.runs, args.batch_size, input_shape)
+        print(f"{model_path}: {result['file_size_mb']:.2f} MB on disk, loaded in {result['load_time_s']:.2f} s, "
+              f"p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms per batch of {args.batch_size}, "
+              f"peak memory {result['peak_memory_mb']:.0f} MB ({result['model_memory_mb']:.0f} MB for loading the model)")
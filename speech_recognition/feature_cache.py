@@ -0,0 +1,168 @@
+import os
+import json
+import atexit
+import hashlib
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Content-addressed on-disk cache of padded mel spectrograms.
+# All spectrograms are stored as float32 in a single binary file (features.bin) that is memory-mapped for reading,
+# next to an index (index.json) that maps each key to its offset and shape.
+# A key combines the SHA-1 of the audio file with the feature parameters, so changing a file or a parameter never returns stale features.
+# Several caches (in one or more processes) can write to the same directory: flush holds a file lock, takes the offset of each
+# spectrogram from the actual end of the data file, and merges its entries into the index on disk instead of replacing it.
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = 'speech_recognition/feature_cache'
+
+
+class FeatureCache:
+    # Pending spectrograms are written to disk automatically once there are flush_interval of them
+    # With variable_length=True, spectrograms are only truncated to max_pad_len frames and not padded, so entries can differ in width
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, n_mels=128, n_fft=2048, hop_length=512, max_pad_len=128, flush_interval=256,
+                 variable_length=False):
+        self.cache_dir = cache_dir
+        self.flush_interval = flush_interval
+        self.lock = threading.RLock()
+        self.params = {'n_mels': n_mels, 'n_fft': n_fft, 'hop_length': hop_length, 'max_pad_len': max_pad_len}
+        if variable_length:
+            self.params['variable_length'] = True
+        self.data_path = os.path.join(cache_dir, 'features.bin')
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.lock_path = os.path.join(cache_dir, 'cache.lock')
+        self.entries = {}
+        self.file_hashes = {}
+        self._data = None
+        self._pending = {}  # Key -> spectrogram, not written yet
+
+        # Reading needs no lock: index.json is replaced atomically, and only after the data it points to has been written
+        os.makedirs(cache_dir, exist_ok=True)
+        self._merge_index()
+
+    # Add the entries and file hashes of the index on disk (written by this or another cache) to those in memory
+    def _merge_index(self):
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+            if index.get('version') == CACHE_VERSION:
+                self.entries = {**index['entries'], **self.entries}
+                self.file_hashes = {**index['file_hashes'], **self.file_hashes}
+
+        # Entries that point past the end of the data file (e.g. after an interrupted write) are dropped
+        data_size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        self.entries = {key: entry for key, entry in self.entries.items()
+                        if entry[0] + 4 * entry[1] * entry[2] <= data_size}
+
+    # Exclusive lock on the cache directory, shared by all processes
+    @contextmanager
+    def _file_lock(self):
+        with open(self.lock_path, 'a+') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    # Hash the contents of a file, reusing the previous hash if its size and modification time are unchanged
+    def file_hash(self, file_path):
+        stat = os.stat(file_path)
+        path = os.path.abspath(file_path)
+        known = self.file_hashes.get(path)
+        if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+
+        sha1 = hashlib.sha1()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        self.file_hashes[path] = [stat.st_size, stat.st_mtime_ns, sha1.hexdigest()]
+        return sha1.hexdigest()
+
+    def key(self, file_path):
+        params = ','.join(f"{name}={value}" for name, value in sorted(self.params.items()))
+        return f"{self.file_hash(file_path)}:{params}"
+
+    # Return the cached spectrogram of a file as a read-only memory-mapped array, or None if it is not cached
+    def get(self, file_path):
+        with self.lock:
+            key = self.key(file_path)
+            if key in self._pending:
+                return self._pending[key]
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            offset, n_mels, n_frames = entry
+            if self._data is None or len(self._data) * 4 < offset + 4 * n_mels * n_frames:
+                self._data = np.memmap(self.data_path, dtype=np.float32, mode='r')
+            start = offset // 4
+            return self._data[start:start + n_mels * n_frames].reshape(n_mels, n_frames)
+
+    # Add a spectrogram to the cache; it is written to disk on the next flush
+    def put(self, file_path, spectrogram):
+        with self.lock:
+            key = self.key(file_path)
+            if key in self.entries or key in self._pending:
+                return
+
+            self._pending[key] = np.array(spectrogram, dtype=np.float32, order='C')
+            if len(self._pending) >= self.flush_interval:
+                self.flush()
+
+    # Return the cached spectrogram of a file, computing and caching it if needed
+    def get_or_compute(self, file_path, compute):
+        spectrogram = self.get(file_path)
+        if spectrogram is None:
+            spectrogram = np.asarray(compute(file_path), dtype=np.float32)
+            self.put(file_path, spectrogram)
+        return spectrogram
+
+    # Append pending spectrograms to the data file and merge the entries into the index
+    # Nothing is written (and no lock is taken) without new spectrograms, so reading from a read-only cache works as well;
+    # new file hashes are saved with the next spectrograms
+    def flush(self):
+        with self.lock:
+            if not self._pending:
+                return
+
+            with self._file_lock():
+                with open(self.data_path, 'ab') as f:
+                    for key, spectrogram in self._pending.items():
+                        self.entries[key] = [f.tell(), spectrogram.shape[0], spectrogram.shape[1]]
+                        f.write(spectrogram.tobytes())
+                self._pending = {}
+
+                self._merge_index()
+                index = {'version': CACHE_VERSION, 'entries': self.entries, 'file_hashes': self.file_hashes}
+                with open(self.index_path + '.tmp', 'w') as f:
+                    json.dump(index, f)
+                os.replace(self.index_path + '.tmp', self.index_path)
+
+
+_shared_caches = {}
+_shared_caches_lock = threading.Lock()
+
+
+# The cache for a directory and set of parameters, shared by all datasets in this process and flushed once at exit
+def shared_cache(cache_dir=DEFAULT_CACHE_DIR, **params):
+    key = (os.path.abspath(cache_dir), tuple(sorted(params.items())))
+    with _shared_caches_lock:
+        cache = _shared_caches.get(key)
+        if cache is None:
+            cache = _shared_caches[key] = FeatureCache(cache_dir, **params)
+            atexit.register(cache.flush)
+    return cache
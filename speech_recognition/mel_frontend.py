@@ -0,0 +1,59 @@
+from functools import lru_cache
+import numpy as np
+import librosa
+
+# Log-mel spectrogram front-end, equivalent to
+#     librosa.power_to_db(librosa.feature.melspectrogram(y=y, sr=sr, n_mels=n_mels, n_fft=n_fft, hop_length=hop_length), ref=np.max)
+# The Hann window and mel filterbank are computed once per configuration, signals are framed with stride tricks (no copies),
+# and equal-length clips are processed as one batched real FFT followed by a single matrix product with the filterbank.
+
+# librosa.stft pads the signal with zeros since librosa 0.10, and reflects it in earlier versions
+DEFAULT_PAD_MODE = 'constant' if tuple(int(v) for v in librosa.__version__.split('.')[:2]) >= (0, 10) else 'reflect'
+
+
+class MelFrontEnd:
+    def __init__(self, sr, n_fft=2048, hop_length=512, n_mels=128, pad_mode=DEFAULT_PAD_MODE, top_db=80.0):
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.n_mels = n_mels
+        self.pad_mode = pad_mode
+        self.top_db = top_db
+        self.window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(n_fft) / n_fft)).astype(np.float32)  # Periodic Hann window
+        self.mel_basis = librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels).astype(np.float32)
+
+    # Log-mel spectrogram of one signal, shape (n_mels, frames)
+    def __call__(self, y):
+        return self.batch(np.asarray(y)[np.newaxis])[0]
+
+    # Log-mel spectrograms of equal-length signals, shape (clips, n_mels, frames); processed block_size clips at a time to bound memory
+    def batch(self, ys, block_size=32):
+        ys = np.asarray(ys, dtype=np.float32)
+        n_frames = 1 + ys.shape[1] // self.hop_length
+        spectrograms = np.empty((len(ys), self.n_mels, n_frames), dtype=np.float32)
+        for start in range(0, len(ys), block_size):
+            spectrograms[start:start + block_size] = self.power_to_db(self.mel_power(ys[start:start + block_size]))
+        return spectrograms
+
+    # Centred frames of each signal as a strided view, shape (clips, frames, n_fft)
+    def frames(self, ys):
+        padded = np.pad(ys, ((0, 0), (self.n_fft // 2, self.n_fft // 2)), mode=self.pad_mode)
+        return np.lib.stride_tricks.sliding_window_view(padded, self.n_fft, axis=1)[:, ::self.hop_length]
+
+    # Mel power spectrograms, shape (clips, n_mels, frames)
+    def mel_power(self, ys):
+        spectra = np.fft.rfft(self.frames(ys) * self.window, axis=2)
+        power = (spectra.real ** 2 + spectra.imag ** 2).astype(np.float32)
+        return np.matmul(self.mel_basis, power.transpose(0, 2, 1))
+
+    # librosa.power_to_db with ref=np.max, applied to each clip separately
+    def power_to_db(self, power, amin=1e-10):
+        ref = np.maximum(amin, power.max(axis=(1, 2), keepdims=True))
+        log_spec = 10.0 * np.log10(np.maximum(amin, power)) - 10.0 * np.log10(ref)
+        return np.maximum(log_spec, log_spec.max(axis=(1, 2), keepdims=True) - self.top_db)
+
+
+# Shared front-end per configuration, so the window and filterbank are only computed once per process
+@lru_cache(maxsize=None)
+def get_frontend(sr, n_fft=2048, hop_length=512, n_mels=128):
+    return MelFrontEnd(sr, n_fft, hop_length, n_mels)
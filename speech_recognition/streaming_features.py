@@ -0,0 +1,187 @@
+import time
+import numpy as np
+
+from mel_frontend import get_frontend, DEFAULT_PAD_MODE
+
+# Online doubt detection: microphone audio is consumed in chunks as it arrives, and mel frames are computed incrementally,
+# so that when the end of the utterance is detected the CNN input is already built and only the forward pass remains.
+#
+# The frames are identical to extract_mel_spectrogram on the complete recording (librosa.stft with center=True):
+# frame t covers samples [t * hop_length - n_fft // 2, t * hop_length + n_fft // 2) of the padded signal, so the last
+# n_fft - hop_length samples of each chunk are kept to overlap with the next one, and the padding at the end is added
+# once the utterance has ended. power_to_db(ref=np.max) needs the maximum over all frames, so frames beyond max_pad_len
+# are still computed to update the running maximum, but not stored. For the same reason the top_db floor is taken relative to
+# that global maximum (0 dB), not to the loudest of the stored frames.
+
+
+class StreamingMelSpectrogram:
+    def __init__(self, sr, n_mels=128, n_fft=2048, hop_length=512, max_pad_len=128, pad_mode=DEFAULT_PAD_MODE,
+                 silence_threshold_db=-40, end_silence=0.8, min_speech=0.2, max_duration=10.0):
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.max_pad_len = max_pad_len
+        self.pad_mode = pad_mode
+        frontend = get_frontend(sr, n_fft, hop_length, n_mels)
+        self.window = frontend.window
+        self.mel_basis = frontend.mel_basis
+        self.top_db = frontend.top_db
+
+        # End of utterance: at least min_speech seconds above silence_threshold_db, followed by end_silence seconds below it
+        self.silence_threshold_db = silence_threshold_db
+        self.end_silence = end_silence
+        self.min_speech = min_speech
+        self.max_duration = max_duration
+        self.reset()
+
+    def reset(self):
+        self.mel_frames = np.zeros((self.mel_basis.shape[0], self.max_pad_len), dtype=np.float32)
+        self.n_frames = 0
+        self.n_samples = 0
+        self.max_power = 0.0
+        self.speech_samples = 0
+        self.silent_samples = 0
+        self.ended = False
+        self.finished = False
+        self._buffer = np.zeros(0, dtype=np.float32)  # Samples of the padded signal from the start of frame n_frames
+        self._started = False
+        self._vad_buffer = np.zeros(0, dtype=np.float32)
+
+    # Add a chunk of audio (float samples in [-1, 1], int16 samples, or raw 16-bit PCM bytes); returns True once the utterance has ended
+    def push(self, chunk):
+        if isinstance(chunk, (bytes, bytearray)):
+            chunk = np.frombuffer(chunk, dtype='<i2')
+        if chunk.dtype == np.int16:
+            chunk = chunk.astype(np.float32) / 32768
+        chunk = np.asarray(chunk, dtype=np.float32)
+
+        self.n_samples += len(chunk)
+        self._buffer = np.concatenate([self._buffer, chunk])
+        if not self._started and (self.pad_mode == 'constant' or len(self._buffer) > self.n_fft // 2):
+            self._buffer = np.pad(self._buffer, (self.n_fft // 2, 0), mode=self.pad_mode)
+            self._started = True
+        if self._started:
+            self._compute_frames()
+
+        self._detect_end(chunk)
+        return self.ended
+
+    # Add the padding at the end of the signal and compute the remaining frames
+    def finish(self):
+        if self.finished:
+            return
+        if not self._started:
+            self._buffer = np.pad(self._buffer, (self.n_fft // 2, 0), mode=self.pad_mode)
+            self._started = True
+        self._buffer = np.pad(self._buffer, (0, self.n_fft // 2), mode=self.pad_mode)
+        self._compute_frames()
+        self.finished = True
+
+    # The log-mel spectrogram of all audio so far, padded to max_pad_len frames, equal to pad_spectrogram(extract_mel_spectrogram(...))
+    def features(self):
+        self.finish()
+        amin = 1e-10
+        n = min(self.n_frames, self.max_pad_len)
+        log_spec = 10.0 * np.log10(np.maximum(amin, self.mel_frames[:, :n])) - 10.0 * np.log10(max(amin, self.max_power))
+        log_spec = np.maximum(log_spec, -self.top_db)
+
+        spectrogram = np.zeros((self.mel_frames.shape[0], self.max_pad_len), dtype=np.float32)
+        spectrogram[:, :n] = log_spec
+        return spectrogram
+
+    # Run the CNN on the features of the utterance; returns the class probabilities (Doubtful, Confident)
+    def predict(self, model):
+        return model.predict_on_batch(self.features()[np.newaxis, :, :, np.newaxis])[0]
+
+    def _compute_frames(self):
+        n_available = (len(self._buffer) - self.n_fft) // self.hop_length + 1
+        if n_available <= 0:
+            return
+
+        # Frame all available windows without copying, and compute their spectra in one batch
+        frames = np.lib.stride_tricks.sliding_window_view(self._buffer, self.n_fft)[::self.hop_length][:n_available]
+        power = np.abs(np.fft.rfft(frames * self.window, axis=1)) ** 2
+        mel = self.mel_basis @ power.T.astype(np.float32)
+        self.max_power = max(self.max_power, float(mel.max()))
+
+        stored = max(0, min(n_available, self.max_pad_len - self.n_frames))
+        self.mel_frames[:, self.n_frames:self.n_frames + stored] = mel[:, :stored]
+        self.n_frames += n_available
+        self._buffer = self._buffer[n_available * self.hop_length:]
+
+    def _detect_end(self, chunk):
+        # Energy is measured per block of hop_length samples
+        self._vad_buffer = np.concatenate([self._vad_buffer, chunk])
+        n_blocks = len(self._vad_buffer) // self.hop_length
+        if n_blocks == 0:
+            return
+        blocks = self._vad_buffer[:n_blocks * self.hop_length].reshape(n_blocks, self.hop_length)
+        self._vad_buffer = self._vad_buffer[n_blocks * self.hop_length:]
+
+        energy_db = 20 * np.log10(np.sqrt(np.mean(blocks ** 2, axis=1)) + 1e-10)
+        for is_speech in energy_db > self.silence_threshold_db:
+            if is_speech:
+                self.speech_samples += self.hop_length
+                self.silent_samples = 0
+            else:
+                self.silent_samples += self.hop_length
+
+        if self.speech_samples >= self.min_speech * self.sr and self.silent_samples >= self.end_silence * self.sr:
+            self.ended = True
+        if self.n_samples >= self.max_duration * self.sr:
+            self.ended = True
+
+
+# Stream a recording through StreamingMelSpectrogram in chunks of chunk_size samples, and return the largest absolute
+# difference (in dB) from the offline features of extract_padded_spectrogram on the whole file
+def compare_with_offline(file_path, chunk_size=1024, max_pad_len=128):
+    from audio_io import load_audio
+    from doubt_detectionCNN import extract_padded_spectrogram
+
+    y, sr = load_audio(file_path, sr=None)
+    features = StreamingMelSpectrogram(sr, max_pad_len=max_pad_len)
+    for start in range(0, len(y), chunk_size):
+        features.push(y[start:start + chunk_size])
+    return float(np.max(np.abs(features.features() - extract_padded_spectrogram(file_path, max_pad_len))))
+
+
+# Listen on the microphone until the end of the utterance and classify it; returns (label, probabilities, latency after the end in seconds)
+def listen_and_predict(model, sample_rate=16000, chunk_size=1024, **kwargs):
+    import speech_recognition as sr
+
+    features = StreamingMelSpectrogram(sample_rate, **kwargs)
+    with sr.Microphone(sample_rate=sample_rate, chunk_size=chunk_size) as source:
+        while not features.push(source.stream.read(chunk_size)):
+            pass
+
+    start = time.perf_counter()
+    probabilities = features.predict(model)
+    label = 'Confident' if np.argmax(probabilities) == 1 else 'Doubtful'
+    return label, probabilities, time.perf_counter() - start
+
+
+# Check that streaming reproduces the offline features, by default on a recording whose loudest part comes after the
+# first max_pad_len frames (so the floor depends on frames that are not stored)
+if __name__ == "__main__":
+    import os
+    import sys
+    import wave
+    import tempfile
+
+    file_paths = sys.argv[1:]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if not file_paths:
+            sr = 22050
+            t = np.arange(5 * sr) / sr
+            y = 0.01 * np.sin(2 * np.pi * 220 * t)
+            y[4 * sr:] = 0.9 * np.sin(2 * np.pi * 440 * t[4 * sr:])  # Peak at 4 s, after the 128 stored frames (~3 s)
+            file_paths = [os.path.join(temp_dir, 'late_peak.wav')]
+            with wave.open(file_paths[0], 'wb') as f:
+                f.setnchannels(1)
+                f.setsampwidth(2)
+                f.setframerate(sr)
+                f.writeframes((y * 32767).astype('<i2').tobytes())
+
+        for file_path in file_paths:
+            difference = compare_with_offline(file_path)
+            print(f"{file_path}: max difference {difference:.2e} dB {'OK' if difference < 1e-3 else 'MISMATCH'}")
@@ -1,11 +1,12 @@
 import os
 import librosa
+from audio_io import load_audio
 import numpy as np
 import matplotlib.pyplot as plt
 
 # Extract pitch and volume for a single audio file
 def extract_features(audio_file):
-    y, sr = librosa.load(audio_file)
+    y, sr = load_audio(audio_file)
 
     # Extract pitch (fundamental frequency)
     pitches, magnitudes = librosa.core.piptrack(y=y, sr=sr)
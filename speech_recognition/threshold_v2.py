@@ -1,5 +1,6 @@
 import os
 import librosa
+from audio_io import load_audio
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -138,7 +139,7 @@ def plot_pairwise_combinations(df, label_col='Doubt'):
 
 # Extract pitch and volume for a single audio file
 def extract_features(audio_file):
-    y, sr = librosa.load(audio_file)
+    y, sr = load_audio(audio_file)
 
     # Extract pitch (fundamental frequency)
     #f0, magnitudes = librosa.core.piptrack(y=y, sr=sr)